@@ -1,27 +1,126 @@
 #!/usr/bin/env python3
 '''main script for MuddySwamp'''
 import sys
+import argparse
 import logging
 import threading
 import queue
 import enum
 import traceback
 import errno
+import signal
+import multiprocessing
 from glob import glob
 # import the MUD server class
 from mudserver import MudServer, Event, EventType
+from asyncserver import AsyncMudServer
+from util.timerwheel import TimerWheel
+from util.tickbudget import TickBudget
 # import modules from the MuddySwamp engine
 import mudimport
 import mudscript
 import control
 import location
+import shard
+
+# number of game ticks per second
+TICK_RATE = 10
 
 # better names welcome
 class MainServer(MudServer):
-    '''Bundles a server and a library together'''
-    def __init__(self, port=1234):
+    '''Bundles a server, a library, and timers together'''
+    def __init__(self, port=1234, tick_rate=TICK_RATE, **kwargs):
         self.lib = mudimport.Library()
-        super().__init__(port)
+        # timers share the resolution of the game tick
+        self.timers = TimerWheel(1 / tick_rate)
+        # links to the other processes, if the world is sharded
+        self.shards = None
+        # maps the ids of players moving to another shard to their
+        # character and any commands they send before they leave
+        self.migrating = {}
+        super().__init__(port, **kwargs)
+
+    def join_shards(self, link):
+        '''run as one shard of the world, connected to the others
+        through [link] (a shard.ShardLink)'''
+        self.shards = link
+        owned = link.claim(self.lib.locations)
+        logging.info("Shard %i owns %i of %i locations."
+                     % (link.index, len(owned), len(self.lib.locations)))
+        for channel in link.channels.values():
+            self.add_reader(channel, lambda channel=channel:
+                            self._receive_migration(channel))
+
+    def migrate(self, char):
+        '''hand [char] to the shard that owns its location, once the
+        current update is finished'''
+        player = char.controller
+        # only players can move between processes for now, so
+        # nonplayers stay behind in the copy of the location
+        if not isinstance(player, control.Player):
+            logging.debug("%s cannot leave this shard." % char)
+            return
+        self.migrating[player.id] = (char, [])
+
+    def send_migrations(self):
+        '''send every migrating player to their new shard'''
+        migrating, self.migrating = self.migrating, {}
+        for id, (char, held) in migrating.items():
+            owner = char.location.shard
+            released = self.release_client(id)
+            if released is None:
+                # the player hung up on the way out
+                continue
+            sock, address, outbox, commands, options = released
+            state = shard.character_state(char)
+            state["address"] = address
+            state["outbox"] = outbox.decode("latin1")
+            state["commands"] = held + commands
+            state["options"] = options
+            try:
+                self.shards.send(owner, state, sock)
+            except Exception:
+                logging.error(traceback.format_exc())
+                # take the player back, their character stays here
+                new_id = self.adopt_client(sock, address, outbox,
+                                           held + commands, options)
+                control.Player.remove_player(id)
+                control.Player(new_id).assume_control(char)
+                continue
+            # the other shard has its own copy of the socket
+            sock.close()
+            # the character's timers would keep firing here, the copy on
+            # the other shard picks up where they left off
+            char.cancel_timers()
+            logging.info("%s moved to shard %i." % (char, owner))
+            # remove the character from this shard
+            char.location.remove_char(char)
+            char.location = None
+            self.lib.chars.pop(str(char), None)
+            control.Player.remove_player(id)
+
+    def _receive_migration(self, channel):
+        '''adopt a player sent over [channel] by another shard'''
+        state, sock = self.shards.receive(channel)
+        if sock is None:
+            logging.error("Player %s arrived without a connection."
+                          % state["name"])
+            return
+        id = self.adopt_client(sock, state["address"],
+                               state["outbox"].encode("latin1"),
+                               state["commands"], state["options"])
+        char = shard.restore_character(state, self.lib)
+        control.Player(id).assume_control(char)
+        self.lib.chars[str(char)] = char
+        new_location = self.lib.locations[state["location"]]
+        new_location.message_chars("%s entered." % char)
+        char.set_location(new_location)
+        char.cmd_look(["look"], verbose=False)
+        logging.info("%s arrived from another shard." % char)
+
+
+class AsyncMainServer(MainServer, AsyncMudServer):
+    '''MainServer using the asyncio backend'''
 
 
 class Greeter(control.Monoreceiver):
@@ -91,6 +190,7 @@ class ServerCommandEnum(enum.Enum):
     ''' basic enum for the type of server command'''
     BROADCAST_MESSAGE = 0
     GET_PLAYERS = 1
+    GET_STATS = 2
 
 class ServerComand:
     '''Simple wrapper class for a server-side command'''
@@ -98,11 +198,34 @@ class ServerComand:
         self.command_type = command_type
         self.params = params
 
+class CommandQueue(queue.Queue):
+    '''Threadsafe queue for server-side commands
+    putting a command wakes the server, so that the MudServerWorker
+    does not have to poll the queue while it waits for players
+    '''
+    def __init__(self, server, *args, **kwargs):
+        self.server = server
+        super().__init__(*args, **kwargs)
+
+    def put(self, item, *args, **kwargs):
+        super().put(item, *args, **kwargs)
+        self.server.wakeup()
+
+
 class MudServerWorker(threading.Thread):
-    def __init__(self, q, server, *args, **kwargs):
+    # longest time (in seconds) the worker will sleep while nothing happens
+    # this keeps periodic server checks (such as idle checks) running
+    MAX_WAIT = 5.0
+
+    def __init__(self, q, server, *args, max_wait=MAX_WAIT, **kwargs):
         self.keep_running = True
         self.q = q
         self.mud = server
+        # setting max_wait to 0 makes the worker poll without ever blocking
+        self.max_wait = max_wait
+        # each pass of the game loop (after waiting for something to
+        # happen) should fit in a game tick
+        self.budget = TickBudget(1 / TICK_RATE)
         mudscript.export_server(self.mud)
         self.mud.lib.import_files(**IMPORT_PATHS)
         logging.info(self.mud.lib.import_results())
@@ -113,77 +236,211 @@ class MudServerWorker(threading.Thread):
     # Cannot call mud.shutdown() here because it will try to call the sockets in run on the final go through
     def shutdown(self):
         self.keep_running = False
+        # wake the worker, in case it is blocked waiting for players
+        self.mud.wakeup()
 
     def run(self):
         logging.info("Starting server.")
         logging.info("Server started successfully.")
         # main game loop. We loop forever (i.e. until the program is terminated)
         while self.keep_running:
+            # 'update' must be called in the loop to keep the game running and give
+            # us up-to-date information
+            # the worker sleeps inside 'update' until a player sends data,
+            # a server command is queued, or the next deadline arrives
+            self.mud.update(self._next_timeout())
+            with self.budget:
+                self._run_pass()
+        # Shut down the mud instance after the while loop finishes
+        self.mud.shutdown()
+
+    def _run_pass(self):
+        '''handle everything that happened during the last 'update',
+        and run any timers that are due'''
+        self._handle_server_commands()
+        self._handle_events()
+        # run any timers (including periodic game logic) that are due
+        self.mud.timers.advance()
+
+        # temporary: move this to a better place later
+        for id, msg in control.Player.receive_messages():
+            self.mud.send_message(id, msg)
+        for id, package, data in control.Player.receive_oob():
+            self.mud.send_gmcp(id, package, data)
+        # hand players over to other shards, now that everything
+        # they should see here has been sent
+        if self.mud.migrating:
+            self.mud.send_migrations()
+
+    def _next_timeout(self):
+        '''return how long (in seconds) the worker may block in 'update'
+        '''
+        # server commands are waiting, so we should not block at all
+        if not self.q.empty():
+            return 0
+        # wake up in time for the next timer (if any)
+        until = self.mud.timers.time_until_next()
+        if until is None:
+            return self.max_wait
+        return min(self.max_wait, until)
+
+    def stats(self):
+        '''return a string summarizing the server's performance counters'''
+        output = "Server stats:\n"
+        for name, value in sorted(self.mud.stats.items()):
+            output += "\t%s: %s\n" % (name, value)
+        flushes = self.mud.stats["flushes"]
+        if flushes:
+            output += ("\twrites saved per flush: %.2f\n"
+                       % (self.mud.stats["writes_saved"] / flushes))
+        # the wait is only measured on some platforms
+        if "accept_wait_ms" in self.mud.stats:
+            output += ("\taverage accept wait: %.1f ms\n"
+                       % (self.mud.stats["accept_wait_ms"]
+                          / self.mud.stats["accepts"]))
+        if self.mud.stats["compress_out"]:
+            output += ("\tcompression ratio: %.2f\n"
+                       % (self.mud.stats["compress_in"]
+                          / self.mud.stats["compress_out"]))
+            output += ("\tcompression cpu per client: %.1f ms\n"
+                       % (self.mud.stats["compress_seconds"] * 1000
+                          / self.mud.stats["compressed_clients"]))
+        output += "\tgame loop passes: %i\n" % self.budget.passes
+        output += ("\tgame loop overruns: %i (budget %.1f ms)\n"
+                   % (self.budget.overruns, self.budget.budget * 1000))
+        output += ("\tlast pass: %.2f ms, longest pass: %.2f ms\n"
+                   % (self.budget.last_duration * 1000,
+                      self.budget.max_duration * 1000))
+        return output
+
+    def _handle_server_commands(self):
+        '''handle every command that has been put on the command queue'''
+        while True:
             try:
                 server_command = self.q.get(block=False)
-                if server_command is not None:
-                    if server_command.command_type == ServerCommandEnum.BROADCAST_MESSAGE:
-                        self.mud.send_message_to_all(server_command.params)
-                    elif server_command.command_type == ServerCommandEnum.GET_PLAYERS:
-                        logging.info("Players: ")
-                        for player in control.Player.player_ids.values():
+            except queue.Empty:
+                return
+            try:
+                if server_command.command_type == ServerCommandEnum.BROADCAST_MESSAGE:
+                    self.mud.send_message_to_all(server_command.params)
+                elif server_command.command_type == ServerCommandEnum.GET_PLAYERS:
+                    logging.info("Players: ")
+                    for player in control.Player.player_ids.values():
+                        compression = self.mud.compression_stats(player.id)
+                        if compression is not None and compression[0]:
+                            raw, compressed, seconds = compression
+                            logging.info("%s compression: %.2f, %.1f ms"
+                                         % (player, raw / max(compressed, 1),
+                                            seconds * 1000))
+                        else:
                             logging.info(str(player))
-
+                elif server_command.command_type == ServerCommandEnum.GET_STATS:
+                    logging.info(self.stats())
             except Exception:
-                pass
+                logging.error(traceback.format_exc())
+
+    def _handle_events(self):
+        '''handle events on the server_queue'''
+        while (len(self.mud.server_queue) > 0):
+            event = self.mud.server_queue.popleft()
+            logging.info(event)
+            id = event.id
+            if event.type is EventType.PLAYER_JOIN:
+                logging.info("Player %s joined." % event.id)
+                # create a controller (a 'Player')
+                new_player = control.Player(event.id)
+
+                # give player a greeter
+                new_player.assume_control(Greeter(self.mud))
+
+            elif event.type is EventType.MESSAGE_RECEIVED:
+                # log the message
+                logging.debug("Event message: " + event.message)
+                # a player on their way to another shard will have their
+                # commands handled there
+                if id in self.mud.migrating:
+                    self.mud.migrating[id][1].append(event.message)
+                    continue
+                try:
+                    control.Player.send_command(id, event.message)
+                except Exception:
+                    logging.error(traceback.format_exc())
+
+            elif event.type is EventType.PLAYER_DISCONNECT:
+                # logging data of the player
+                player = control.Player.player_ids[id]
+                logging.info("%s left" % player)
+                if player.receiver is not None:
+                    pass
+                    #self.mud.send_message_to_all("%s quit the game" % player.receiver)
+                control.Player.remove_player(id)
+            elif event.type is EventType.PLAYER_AFK:
+                logging.info("%s is away" % control.Player.player_ids[id])
+            elif event.type is EventType.PLAYER_RETURN:
+                logging.info("%s is back" % control.Player.player_ids[id])
+
+def run_shard(index, count, port, channels, server_cls=None):
+    '''run shard number [index] of [count] in this process, connected to
+    the other shards through [channels] (see shard.make_channels)
+    [server_cls] = the server class to use [default: MainServer]'''
+    threading.current_thread().name = "Shard-%i" % index
+    if server_cls is None:
+        server_cls = MainServer
+    # every shard listens on the same port, and the operating system
+    # spreads new players between them
+    server = server_cls(port, reuse_port=True)
+    worker = MudServerWorker(CommandQueue(server), server)
+    server.join_shards(shard.ShardLink(index, count, channels))
+    # the main process handles CTRL-C, and stops us with SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.shutdown())
+    worker.run()
 
-            # 'update' must be called in the loop to keep the game running and give
-            # us up-to-date information
-            self.mud.update()
-
-            # handle events on the server_queue
-            while (len(self.mud.server_queue) > 0):
-                event = self.mud.server_queue.popleft()
-                logging.info(event)
-                id = event.id
-                if event.type is EventType.PLAYER_JOIN:
-                    logging.info("Player %s joined." % event.id)
-                    # create a controller (a 'Player')
-                    new_player = control.Player(event.id)
-
-                    # give player a greeter
-                    new_player.assume_control(Greeter(self.mud))
-
-                elif event.type is EventType.MESSAGE_RECEIVED:
-                    # log the message
-                    logging.debug("Event message: " + event.message)
-                    try:
-                        control.Player.send_command(id, event.message)
-                    except Exception:
-                        logging.error(traceback.format_exc())
-
-                elif event.type is EventType.PLAYER_DISCONNECT:
-                    # logging data of the player
-                    player = control.Player.player_ids[id]
-                    logging.info("%s left" % player)
-                    if player.receiver is not None:
-                        pass
-                        #self.mud.send_message_to_all("%s quit the game" % player.receiver)
-                    control.Player.remove_player(id)
-
-            # temporary: move this to a better place later
-            for id, msg in control.Player.receive_messages():
-                self.mud.send_message(id, msg)
-        # Shut down the mud instance after the while loop finishes
-        self.mud.shutdown()
 
 if __name__ == "__main__":
-    # parse arguments for port number
-    # if we get more complex, we will need an argparser
-    port = 1234
-    if len(sys.argv) > 1:
+    parser = argparse.ArgumentParser(description="Run a MuddySwamp server.")
+    parser.add_argument("port", nargs="?", type=int, default=1234,
+                        help="port to listen on [default: 1234]")
+    parser.add_argument("--asyncio", action="store_true",
+                        help="handle connections with asyncio instead of"
+                             " the select-based server")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="split the world between this many processes"
+                             " (Unix only) [default: 1]")
+    args = parser.parse_args()
+    port = args.port
+
+    server_cls = AsyncMainServer if args.asyncio else MainServer
+
+    if args.shards > 1:
+        channels = shard.make_channels(args.shards)
+        # the shards inherit the channels, so we must fork
+        context = multiprocessing.get_context("fork")
+        processes = [context.Process(target=run_shard, name="Shard-%i" % i,
+                                     args=(i, args.shards, port, channels[i],
+                                           server_cls))
+                     for i in range(args.shards)]
+        for process in processes:
+            process.start()
+        for shard_channels in channels:
+            for channel in shard_channels.values():
+                channel.close()
+        # the admin console is not available, as each shard runs its own
+        # copy of the world
+        logging.info("Running %i shards. Press CTRL-C to stop." % args.shards)
         try:
-            port = int(sys.argv[1])
-        except ValueError:
-            print("Error. Port must be an integer.", file=sys.stderr)
-            exit(-1)
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            logging.info("Keyboard interrupt detected. Shutting down.")
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
+        exit()
+
     try:
-        server = MainServer(port)
+        server = server_cls(port)
     except PermissionError:
         print("Error. Do not have permission to use port '%s'" % port, file=sys.stderr)
         exit(-1)
@@ -196,7 +453,8 @@ if __name__ == "__main__":
 
 
     # Create a threadsafe queue for commands entered on the server side
-    command_queue = queue.Queue()
+    # (the queue wakes the server whenever a command is put on it)
+    command_queue = CommandQueue(server)
     # Create an instance of the thread and start it
     thread = MudServerWorker(command_queue, server)
     thread.setName("MudServerThread")
@@ -212,6 +470,8 @@ if __name__ == "__main__":
                     command_queue.put(ServerComand(ServerCommandEnum.BROADCAST_MESSAGE, u"\u001b[32m" + "[Server] " + params + u"\u001b[0m"))
                 elif command == "players":
                     command_queue.put(ServerComand(ServerCommandEnum.GET_PLAYERS, ""))
+                elif command == "stats":
+                    command_queue.put(ServerComand(ServerCommandEnum.GET_STATS, ""))
                 elif command == "stop":
                     command_queue.put(ServerComand(ServerCommandEnum.BROADCAST_MESSAGE, u"\u001b[32m" + "[Server] " + "Server shutting down..." + u"\u001b[0m"))
                     break
@@ -219,6 +479,7 @@ if __name__ == "__main__":
                     logging.info("Server commands are: \n" \
                     " broadcast [message] - Broadcasts a message to the entire server\n"\
                     " players - Prints a list of all players\n" \
+                    " stats - Prints the server's performance counters\n" \
                     " stop - Stops the server\n" \
                     " list [locations|items|chars] - list all available loaded locations/items/chars\n" \
                     " shell - enter a python shell\n")
@@ -0,0 +1,361 @@
+"""asyncio backend for the MUD server
+
+Contains AsyncMudServer, which offers the same interface as MudServer
+('update', 'send_message', 'send_message_to_all', 'shutdown', 'wakeup'
+and the 'server_queue' of events), but leaves the sockets to an asyncio
+event loop. Telnet parsing, command release, output buffering and idle
+tracking are all inherited from MudServer, so both backends behave the
+same way.
+
+The server can be driven in two ways:
+    - by calling 'update' in a loop, exactly like MudServer. The server
+      runs its own event loop for the duration of each call
+    - from a coroutine, by passing in the running loop and awaiting
+      'start' and then 'update_async'. This lets the game loop run
+      alongside other tasks (such as timers or an admin console) without
+      a thread of its own
+"""
+import os
+import socket
+import asyncio
+import selectors
+import time
+import logging
+from mudserver import MudServer
+
+
+class _MudProtocol(asyncio.Protocol):
+    """Connects the transport of a single client to an AsyncMudServer"""
+
+    def __init__(self, server, clid=None):
+        self.server = server
+        # set in advance for a client adopted from elsewhere
+        self.clid = clid
+
+    def connection_made(self, transport):
+        if self.clid is None:
+            self.clid = self.server._connection_made(transport)
+        else:
+            self.server._connection_adopted(self.clid, transport)
+
+    def data_received(self, data):
+        self.server._data_received(self.clid, data)
+
+    def connection_lost(self, exc):
+        self.server._connection_lost(self.clid)
+
+    def pause_writing(self):
+        self.server._pause_writing(self.clid)
+
+    def resume_writing(self):
+        self.server._resume_writing(self.clid)
+
+
+class AsyncMudServer(MudServer):
+    """A MudServer that uses asyncio instead of polling sockets itself.
+
+    Each client is handled by a protocol object, which the event loop
+    calls as soon as data arrives. Idle connections cost nothing, as the
+    loop only wakes for clients that are actually doing something.
+    """
+
+    class _Client(MudServer._Client):
+        """Holds information about a connected player"""
+
+        # the asyncio transport used to communicate with the client
+        transport = None
+
+    def __init__(self, *args, loop=None, **kwargs):
+        """Constructs the AsyncMudServer object. Takes the same arguments
+        as MudServer, as well as:
+            loop - the event loop to run on. If the loop is already
+                   running, 'start' must be awaited before the server
+                   accepts players [default: a new event loop]
+        """
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            self._owns_loop = True
+        else:
+            self._owns_loop = False
+        self._loop = loop
+        self._server = None
+        # set whenever something happens that 'update' should handle
+        self._ready = asyncio.Event()
+        super().__init__(*args, **kwargs)
+
+    def _start_listening(self, port):
+        self._port = port
+        # if the loop is running, we are inside a coroutine, and the
+        # caller must await 'start' themselves
+        if not self._loop.is_running():
+            self._loop.run_until_complete(self.start())
+
+    async def start(self):
+        """Starts listening for new players."""
+        logging.debug("Starting listening socket.")
+        self._server = await self._loop.create_server(
+            lambda: _MudProtocol(self), "0.0.0.0", self._port,
+            reuse_address=True, reuse_port=self._reuse_port or None,
+            backlog=self._backlog)
+        logging.info("Listening on " + ":".join(
+            map(str, self._server.sockets[0].getsockname())))
+
+    def update(self, timeout=0):
+        """Checks for new players, disconnected players, and new
+        messages sent from players, running the event loop for up to
+        'timeout' seconds. See MudServer.update.
+        This cannot be called from a coroutine; use 'update_async'.
+        """
+        self._loop.run_until_complete(self.update_async(timeout))
+
+    async def update_async(self, timeout=0):
+        """Coroutine version of 'update'. Waits up to 'timeout' seconds
+        (forever, if None) for something to happen.
+        """
+
+        # send everything queued since the last update before we wait
+        self.flush()
+
+        # if commands are still waiting from the last update, don't wait
+        if self._backlogged:
+            timeout = 0
+
+        # let the event loop handle any waiting I/O. Our protocols set
+        # '_ready' when something arrives, ending the wait early
+        if timeout is not None and timeout <= 0:
+            await asyncio.sleep(0)
+        else:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._ready.clear()
+
+        self._check_for_stalled()
+        self._idle_timers.advance()
+        self._release_commands()
+
+        # see MudServer.update
+        self._events = list(self._new_events)
+        self._new_events = []
+
+    def wakeup(self):
+        """Interrupts a call to 'update', causing it to return early.
+        Unlike the rest of the server, this method is safe to call from
+        other threads.
+        """
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # the loop has been closed
+            pass
+
+    def add_reader(self, fileobj, callback):
+        """Calls 'callback' with no arguments whenever 'fileobj' is
+        readable. See MudServer.add_reader.
+        """
+        def read():
+            callback()
+            self._ready.set()
+        self._readers[fileobj] = callback
+        self._loop.add_reader(fileobj, read)
+
+    def remove_reader(self, fileobj):
+        """Stops polling a file added with 'add_reader'."""
+        del self._readers[fileobj]
+        self._loop.remove_reader(fileobj)
+
+    def adopt_client(self, sock, address, outbox=b"", commands=(),
+                     options=()):
+        """Takes over a client socket that was connected elsewhere. See
+        MudServer.adopt_client.
+        The socket is wrapped in a transport by the event loop, so
+        nothing is sent to the client until the next 'update'.
+        """
+        clid = super().adopt_client(sock, address, outbox, commands,
+                                    options)
+        self._loop.create_task(self._adopt_transport(clid, sock))
+        return clid
+
+    async def _adopt_transport(self, clid, sock):
+        try:
+            await self._loop.connect_accepted_socket(
+                lambda: _MudProtocol(self, clid), sock)
+        except Exception as ex:
+            logging.error("Could not adopt client %i: %s" % (clid, ex))
+            self._handle_disconnect(clid)
+            self._ready.set()
+
+    def release_client(self, clid):
+        """Removes the client with id 'clid' from the server without
+        disconnecting it. See MudServer.release_client.
+        The client's transport is closed, and a duplicate of its socket
+        is returned. Output that the transport is still holding for a
+        client that has fallen behind cannot be recovered, and is lost.
+        """
+        cl = self._clients.get(clid)
+        if cl is None:
+            return None
+        # anything still queued goes into the outbox that is handed over,
+        # rather than to the transport. The transport (or the task still
+        # creating one) keeps the original socket, and closes it
+        transport, cl.transport = cl.transport, None
+        cl.interest = 0
+        released = super().release_client(clid)
+        if released is not None:
+            sock = socket.socket(fileno=os.dup(cl.socket.fileno()))
+            released = (sock,) + released[1:]
+        if transport is not None:
+            # the transport must not report the client as disconnected
+            transport.get_protocol().clid = None
+            transport.abort()
+        return released
+
+    def shutdown(self):
+        """Closes down the server, disconnecting all clients and
+        closing the listen socket.
+        """
+        for cl in list(self._clients.values()):
+            if cl.transport is None:
+                # adopted, and still waiting for a transport
+                cl.socket.close()
+                continue
+            if cl.compressor is not None:
+                self._end_compression(cl)
+            # make a last attempt to send anything still waiting
+            if cl.outbox:
+                cl.transport.write(bytes(cl.outbox))
+                cl.outbox.clear()
+            cl.transport.close()
+        if self._server is not None:
+            self._server.close()
+        if not self._loop.is_running():
+            # give the transports a chance to finish closing
+            self._loop.run_until_complete(asyncio.sleep(0))
+            if self._owns_loop:
+                self._loop.close()
+
+    def _connection_made(self, transport):
+
+        # called by a protocol when a new client connects. asyncio accepts
+        # every waiting client by itself, so 'max_accepts' does not apply
+        sock = transport.get_extra_info("socket")
+        addr = transport.get_extra_info("peername")
+        if not self._allow_connection(addr[0]):
+            logging.warning("Refusing client at %s, which is connecting too"
+                            " often." % ":".join(map(str, addr)))
+            self.stats["refused"] += 1
+            transport.write(b"Too many connections from your address."
+                            b" Try again later.\n\r")
+            transport.close()
+            return None
+        logging.info("Client connected at: " + ":".join(map(str, addr)))
+        self._record_accept(sock)
+        self._set_keepalive(sock)
+
+        cl = self._Client(sock, addr[0], b"", time.monotonic())
+        cl.transport = transport
+        # transports start out reading
+        cl.interest = selectors.EVENT_READ
+        # the transport tells us (with pause_writing and resume_writing)
+        # when too much data is waiting to be sent to the client
+        transport.set_write_buffer_limits(high=self._high_water,
+                                          low=self._low_water)
+        clid = self._add_client(cl)
+        self._ready.set()
+        return clid
+
+    def _data_received(self, clid, data):
+        cl = self._clients.get(clid)
+        if cl is None:
+            return
+        self._handle_data(clid, cl, data)
+        # stop reading, if the client has sent too many commands
+        self._update_interest(clid, cl)
+        # wake 'update' for new commands, or replies to Telnet commands
+        if cl.commands or cl.outbox:
+            self._ready.set()
+
+    def _connection_adopted(self, clid, transport):
+
+        # called by the protocol of a client from 'adopt_client', once
+        # the event loop has wrapped its socket in a transport
+        cl = self._clients.get(clid)
+        if cl is None:
+            # released or disconnected in the meantime
+            transport.close()
+            return
+        cl.socket = transport.get_extra_info("socket")
+        cl.transport = transport
+        cl.interest = selectors.EVENT_READ
+        transport.set_write_buffer_limits(high=self._high_water,
+                                          low=self._low_water)
+        self._update_interest(clid, cl)
+        # send anything queued while we waited for the transport
+        if cl.outbox or cl.staged:
+            self._unflushed.add(clid)
+        self._ready.set()
+
+    def _connection_lost(self, clid):
+        if clid is None:
+            return
+        self._handle_disconnect(clid)
+        self._ready.set()
+
+    def _pause_writing(self, clid):
+        cl = self._clients.get(clid)
+        if cl is not None and cl.stalled_since is None:
+            self._stall(clid, cl, cl.transport.get_write_buffer_size())
+
+    def _resume_writing(self, clid):
+        cl = self._clients.get(clid)
+        if cl is not None and cl.stalled_since is not None:
+            self._unstall(clid, cl)
+
+    def _flush_client(self, clid, cl):
+
+        if cl.staged:
+            self._compress_staged(cl)
+
+        # an adopted client's outbox waits until it has a transport
+        if cl.transport is None:
+            return
+
+        # hand the whole outbox to the transport, which sends what it can
+        # right away and buffers the rest. The transport keeps a reference
+        # to what we give it, so we start a new outbox instead of clearing
+        # this one
+        if cl.outbox:
+            self.stats["writes"] += 1
+            data, cl.outbox = cl.outbox, bytearray()
+            cl.transport.write(data)
+
+    def _update_interest(self, clid, cl):
+
+        # the transport always watches for writability itself, so we only
+        # need to pause reading from clients with too many commands waiting
+        # (an adopted client is read from once its transport is made)
+        if cl.transport is None:
+            return
+        reading = len(cl.commands) < self._max_backlog
+        if reading == bool(cl.interest & selectors.EVENT_READ):
+            return
+        if reading:
+            cl.transport.resume_reading()
+            cl.interest = selectors.EVENT_READ
+        else:
+            cl.transport.pause_reading()
+            cl.interest = 0
+
+    def _close_client(self, cl):
+
+        # an adopted client without a transport yet is closed by the task
+        # creating one (see _connection_adopted)
+        if cl.transport is None:
+            return
+        # a stalled client may never read what is waiting for it, so we
+        # discard it instead of waiting for it to be sent
+        if cl.stalled_since is not None:
+            cl.transport.abort()
+        else:
+            cl.transport.close()
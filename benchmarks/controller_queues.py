@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+'''microbenchmark comparing the deque-based control.Player against the
+original, which kept its commands and messages in queue.Queue objects
+usage: python benchmarks/controller_queues.py [-p PLAYERS] [-m MESSAGES]
+                                             [-s SPEAKERS]
+'''
+import os
+import sys
+import queue
+import timeit
+import argparse
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import control
+
+
+class QueuePlayer(control.Player):
+    '''the Player this benchmark compares against'''
+
+    def __init__(self, id):
+        super().__init__(id)
+        self._command_queue = queue.Queue()
+        self._message_queue = queue.Queue()
+
+    def read_cmd(self):
+        return self._command_queue.get()
+
+    def write_msg(self, msg):
+        self._message_queue.put(msg)
+
+    def has_cmd(self):
+        return not self._command_queue.empty()
+
+    def has_msg(self):
+        return not self._message_queue.empty()
+
+    @classmethod
+    def send_command(cls, id, command):
+        player = control.Player.player_ids[id]
+        player._command_queue.put(command)
+        player.poke()
+
+    @classmethod
+    def receive_messages(cls):
+        # every player is checked, whether or not it has messages
+        for id, player in control.Player.player_ids.items():
+            while player.has_msg():
+                yield (id, player._message_queue.get())
+
+
+def run(player_cls, speakers, messages):
+    '''send a command and [messages] messages through each of the first
+    [speakers] players, the way the game loop does'''
+    for id in range(speakers):
+        player_cls.send_command(id, "say hello")
+    for id in range(speakers):
+        player = control.Player.player_ids[id]
+        while player.has_cmd():
+            player.read_cmd()
+        for i in range(messages):
+            player.write_msg("Somebody says: hello")
+    for _ in player_cls.receive_messages():
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-p", "--players", type=int, default=100)
+    parser.add_argument("-m", "--messages", type=int, default=20,
+                        help="messages written to each player per round")
+    parser.add_argument("-s", "--speakers", type=int, default=None,
+                        help="players given a command and messages per"
+                        " round (the rest stay idle) [default: all]")
+    parser.add_argument("-n", "--number", type=int, default=200,
+                        help="number of rounds")
+    args = parser.parse_args()
+    if args.speakers is None:
+        args.speakers = args.players
+    results = {}
+    for player_cls in (QueuePlayer, control.Player):
+        control.Player.player_ids.clear()
+        for id in range(args.players):
+            player_cls(id)
+        results[player_cls] = timeit.timeit(
+            lambda: run(player_cls, args.speakers, args.messages),
+            number=args.number)
+    control.Player.player_ids.clear()
+    total = args.number * args.speakers * (args.messages + 1)
+    old, new = results[QueuePlayer], results[control.Player]
+    print("%i players, %i of them getting %i messages and 1 command"
+          " per round" % (args.players, args.speakers, args.messages))
+    print("  queue.Queue: %8.0f items/s" % (total / old))
+    print("  deque:       %8.0f items/s  (%.1fx)" % (total / new, old / new))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+'''load test holding many idle connections open against a server backend
+Measures how long the connections take to open, the CPU the server uses
+while they sit idle, its memory use, and the round trip time of a
+command sent by one active client among them.
+The server runs in a separate process, so that the clients do not
+compete with it for the interpreter lock.
+usage: python benchmarks/idle_connections.py [--asyncio] [-n CONNECTIONS]
+'''
+import os
+import sys
+import time
+import socket
+import argparse
+import resource
+import threading
+import multiprocessing
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from mudserver import MudServer, EventType
+from asyncserver import AsyncMudServer
+
+
+def raise_fd_limit(needed):
+    '''make sure this process can open [needed] file descriptors'''
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft >= needed:
+        return
+    if hard != resource.RLIM_INFINITY and hard < needed:
+        sys.exit("Need %i file descriptors, but the limit is %i."
+                 % (needed, hard))
+    resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
+
+
+def run_server(server_cls, port, connections, backlog, pipe):
+    '''run a server that echoes every command back to its sender
+    requests arriving on [pipe] are answered from a second thread:
+        "clients" - the number of connected clients
+        "cpu" - the CPU time used by this process so far
+        "rss" - the peak memory use of this process (in KiB)
+        "stop" - shut the server down
+    '''
+    raise_fd_limit(connections + 100)
+    # disable idle timeouts and rate limits, so the test connections
+    # (which all come from one address) are left alone
+    server = server_cls(port, afk_timeout=None, idle_timeout=None,
+                        connection_rate=None, backlog=backlog)
+    running = True
+
+    def answer():
+        nonlocal running
+        while True:
+            request = pipe.recv()
+            if request == "clients":
+                pipe.send(len(server._clients))
+            elif request == "cpu":
+                pipe.send(time.process_time())
+            elif request == "rss":
+                pipe.send(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+            elif request == "stop":
+                running = False
+                server.wakeup()
+                return
+
+    threading.Thread(target=answer, daemon=True).start()
+    pipe.send("ready")
+    while running:
+        server.update(1.0)
+        while server.server_queue:
+            event = server.server_queue.popleft()
+            if event.type is EventType.MESSAGE_RECEIVED:
+                server.send_message(event.id, event.message)
+    server.shutdown()
+
+
+def ask(pipe, request):
+    pipe.send(request)
+    return pipe.recv()
+
+
+def open_connections(port, count):
+    '''open [count] connections to the server, returns a list of sockets'''
+    clients = []
+    for _ in range(count):
+        while True:
+            try:
+                clients.append(socket.create_connection(("127.0.0.1", port)))
+                break
+            except ConnectionRefusedError:
+                # the listen queue is full, try again shortly
+                time.sleep(0.01)
+    return clients
+
+
+def round_trip(sock, rounds=200):
+    '''returns the median time for a command to be echoed back'''
+    times = []
+    for i in range(rounds):
+        start = time.perf_counter()
+        sock.sendall(b"ping %i\n" % i)
+        data = b""
+        while not data.endswith(b"\n\r"):
+            data += sock.recv(4096)
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--asyncio", action="store_true",
+                        help="test AsyncMudServer instead of MudServer")
+    parser.add_argument("-n", "--connections", type=int, default=5000)
+    parser.add_argument("-p", "--port", type=int, default=4321)
+    parser.add_argument("--idle", type=float, default=10.0,
+                        help="seconds to leave the connections idle")
+    parser.add_argument("--backlog", type=int, default=MudServer.BACKLOG,
+                        help="listen backlog of the server")
+    args = parser.parse_args()
+    raise_fd_limit(args.connections + 100)
+
+    server_cls = AsyncMudServer if args.asyncio else MudServer
+    pipe, child_pipe = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=run_server,
+                                     args=(server_cls, args.port,
+                                           args.connections, args.backlog,
+                                           child_pipe))
+    server.start()
+    pipe.recv()
+
+    start = time.perf_counter()
+    clients = open_connections(args.port, args.connections)
+    while ask(pipe, "clients") < args.connections:
+        time.sleep(0.1)
+    connect_time = time.perf_counter() - start
+
+    # measure the server's CPU use with every connection idle
+    cpu = ask(pipe, "cpu")
+    start = time.perf_counter()
+    time.sleep(args.idle)
+    elapsed = time.perf_counter() - start
+    idle_cpu = ask(pipe, "cpu") - cpu
+
+    latency = round_trip(clients[0])
+    rss = ask(pipe, "rss")
+    pipe.send("stop")
+    server.join()
+    for sock in clients:
+        sock.close()
+
+    print("%s with %i connections" % (server_cls.__name__, args.connections))
+    print("  connecting:  %.2f s" % connect_time)
+    print("  idle cpu:    %.3f s over %.0f s" % (idle_cpu, elapsed))
+    print("  round trip:  %.3f ms (median)" % (latency * 1000))
+    print("  server rss:  %.1f MiB (peak)" % (rss / 1024))
+
+
+if __name__ == "__main__":
+    main()
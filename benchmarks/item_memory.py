@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+'''memory benchmark of a world seeded with many items, comparing stacked,
+shared item instances without a __dict__ against the original layout,
+which kept a new instance (with a __dict__) for every unit of an item
+usage: python benchmarks/item_memory.py [-n ITEMS] [-l LOCATIONS]
+'''
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from item import make_item
+from location import Location
+import scripts.materialItems as mi
+
+
+class OriginalInventory:
+    '''the Inventory this benchmark compares against'''
+
+    def __init__(self):
+        self._items = {}
+
+    def add_item(self, item, quantity=1):
+        name_dict = self._items.setdefault(item.item_type, {})
+        name_dict.setdefault(item.name, [])
+        name_dict[item.name] += [item] * quantity
+
+
+def original_item(item_class):
+    '''returns a copy of [item_class] as it was originally defined,
+    whose instances have a __dict__ and set their own name'''
+    def __init__(self):
+        self._item_name = str(type(self))
+    return type(item_class)(item_class.__name__, (item_class,),
+                            {"stackable": False, "__init__": __init__})
+
+
+ITEM_CLASSES = [mi.IronIngot, mi.WoodPlank, mi.SteelIngot,
+                mi.GatorBoneShard]
+
+
+def seed_original(count, locations):
+    '''one new instance per unit, as the world importer used to add them'''
+    classes = [original_item(cls) for cls in ITEM_CLASSES]
+    world = [OriginalInventory() for _ in range(locations)]
+    for index in range(count):
+        world[index % locations].add_item(classes[index % len(classes)]())
+    return world
+
+
+def seed_stacked(count, locations):
+    '''one shared instance, added [quantity] times to each location'''
+    world = [Location("Room %i" % i, "A room.") for i in range(locations)]
+    for index, loc in enumerate(world):
+        for offset, cls in enumerate(ITEM_CLASSES):
+            # the number of units seed_original puts in this location
+            quantity = len(range(index + offset * locations, count,
+                                 locations * len(ITEM_CLASSES)))
+            if quantity:
+                loc.add_item(make_item(cls), quantity)
+    return world
+
+
+def measure(seed, count, locations):
+    '''returns the memory allocated by seed (in bytes) and its time'''
+    tracemalloc.start()
+    start = time.perf_counter()
+    world = seed(count, locations)
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del world
+    return size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-n", "--items", type=int, default=100000)
+    parser.add_argument("-l", "--locations", type=int, default=100)
+    args = parser.parse_args()
+    # create the shared instances up front, like loading the world would
+    for cls in ITEM_CLASSES:
+        make_item(cls)
+    print("%i items across %i locations" % (args.items, args.locations))
+    old, old_time = measure(seed_original, args.items, args.locations)
+    new, new_time = measure(seed_stacked, args.items, args.locations)
+    print("  original: %8.1f KiB  %7.1f ms" % (old / 1024, old_time * 1000))
+    print("  stacked:  %8.1f KiB  %7.1f ms  (%.0fx less memory)"
+          % (new / 1024, new_time * 1000, old / new))
+
+
+if __name__ == "__main__":
+    main()
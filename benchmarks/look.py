@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+'''microbenchmark of looking around, and walking in and out of, a location
+with many filtered exits and entities, comparing the cached
+CharFilter.permits against the original, which walked the ancestors of
+the character's class on every call
+usage: python benchmarks/look.py [-e EXITS] [-n ENTITIES]
+'''
+import os
+import sys
+import timeit
+import argparse
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import entity
+from character import Character, CharacterClass, CharFilter
+from location import Location, Exit
+
+
+def original_permits(self, other):
+    '''the CharFilter.permits this benchmark compares against'''
+    if isinstance(other, Character):
+        if other in self._include_chars:
+            return True
+        elif other in self._exclude_chars:
+            return False
+        other = type(other)
+    if isinstance(other, CharacterClass):
+        ancestors = filter(lambda x: isinstance(x, CharacterClass),
+                           other.__mro__)
+        for char_class in ancestors:
+            if char_class in self._classes:
+                return self._mode.value
+    else:
+        return False
+    return not self._mode.value
+
+
+# a small family of classes, so that filters have ancestors to check
+class Adventurer(Character):
+    pass
+
+
+class Fighter(Adventurer):
+    pass
+
+
+class Knight(Fighter):
+    pass
+
+
+class Wizard(Adventurer):
+    pass
+
+
+class Shrine(entity.Entity):
+    '''an entity with commands for some classes only'''
+
+    @entity.filtered_command(CharFilter("whitelist", [Wizard]))
+    def pray(self, char, args):
+        pass
+
+    @entity.filtered_command(CharFilter("blacklist", [Wizard]))
+    def kneel(self, char, args):
+        pass
+
+
+def build(exits, entities):
+    '''returns a location with [exits] exits and [entities] entities, and
+    a second location to walk to'''
+    room = Location("Great Hall", "A hall with a great many doors.")
+    other = Location("Corridor", "A corridor.")
+    for index in range(exits):
+        # alternate between exits everyone can see, and hidden ones
+        if index % 2:
+            visibility = CharFilter("whitelist", [Fighter])
+        else:
+            visibility = CharFilter("blacklist", [Wizard])
+        room.add_exit(Exit(other, "door%i" % index, visibility=visibility))
+    room.add_exit(Exit(other, "out"))
+    for index in range(entities):
+        Shrine("shrine%i" % index).set_location(room)
+    return room, other
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-e", "--exits", type=int, default=100)
+    parser.add_argument("-n", "--entities", type=int, default=20)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+    room, other = build(args.exits, args.entities)
+    knight = Knight("Sir Bench")
+    knight.set_location(room)
+
+    def look():
+        knight.cmd_look(["look"])
+
+    def walk():
+        knight.set_location(other)
+        knight.set_location(room)
+
+    cached_permits = CharFilter.permits
+    print("%i exits, %i entities" % (args.exits, args.entities))
+    for name, func in (("look", look), ("walk in/out", walk)):
+        CharFilter.permits = original_permits
+        old = timeit.timeit(func, number=args.number)
+        CharFilter.permits = cached_permits
+        new = timeit.timeit(func, number=args.number)
+        print("  %-12s original: %8.1f us  cached: %8.1f us  (%.1fx)"
+              % (name, old / args.number * 1e6, new / args.number * 1e6,
+                 old / new))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+'''microbenchmark comparing MudServer._process_sent_data against the
+original parser, which walked the received data one character at a time
+usage: python benchmarks/telnet_parser.py
+'''
+import os
+import sys
+import timeit
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from mudserver import MudServer
+
+
+def original_parser(client, data):
+    '''the parser this benchmark compares against (returns the last line)'''
+    message = None
+    state = 1
+    for c in data:
+        if state == 1:
+            if ord(c) == 255:
+                state = 2
+            elif c == "\n":
+                message = client.buffer
+                client.buffer = ""
+            elif c == "\x08":
+                client.buffer = client.buffer[:-1]
+            else:
+                client.buffer += c
+        elif state == 2:
+            if ord(c) == 250:
+                state = 3
+            elif ord(c) in (251, 252, 253, 254):
+                state = 2
+            else:
+                state = 1
+        elif state == 3:
+            if ord(c) == 240:
+                state = 1
+    return message
+
+
+class OldClient:
+    buffer = ""
+
+
+# sample packets: a typed command, a burst of commands with some telnet
+# negotiation, and a long paste
+PACKETS = {
+    "command": b"look\r\n",
+    "burst": b"\xff\xfb\x18\xff\xfd\x01" + b"north\r\nsay hello there\r\n" * 20,
+    "paste": (b"say " + b"lorem ipsum dolor sit amet " * 150 + b"\r\n") * 1,
+}
+
+
+def main(number=2000):
+    server = MudServer.__new__(MudServer)
+    for name, packet in PACKETS.items():
+        text = packet.decode("latin1")
+        old_client = OldClient()
+        old = timeit.timeit(lambda: original_parser(old_client, text),
+                            number=number)
+        new_client = MudServer._Client(None, "", b"", 0)
+        new = timeit.timeit(lambda: server._process_sent_data(new_client, packet),
+                            number=number)
+        print("%-8s %6i bytes  original: %8.2f us  current: %8.2f us  (%.1fx)"
+              % (name, len(packet), old / number * 1e6, new / number * 1e6,
+                 old / new))
+
+
+if __name__ == "__main__":
+    main()
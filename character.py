@@ -4,7 +4,8 @@ import util
 import control
 import inventory
 import item
-from command import Command, CommandDict
+import mudscript
+from command import Command, CommandDict, CommandTable
 
 class CharException(Exception):
     pass
@@ -47,6 +48,8 @@ class CharacterClass(type):
         name: how the class appears to the players
         _unique_cmds: a list of commands not found in base classes
         command_class: a list of commands not found in base classes
+        cmd_table: CommandTable of the (unbound) commands shared by
+            every character of the class
     '''
     def __init__(self, cls, bases, namespace):
         # creating the proper name, if one is not provided
@@ -79,6 +82,15 @@ class CharacterClass(type):
                 else:
                     self.cmd_classes[base.classname] = base._unique_cmds
 
+        # build the commands once for the whole class. Characters only
+        # store the commands added by items and entities on top of these
+        cmd_table = []
+        for cmd_class, cmd_names in self.cmd_classes.items():
+            for cmd_name in cmd_names:
+                cmd_table.append(Command(cmd_name[4:], getattr(self, cmd_name),
+                                         cmd_class))
+        self.cmd_table = CommandTable(cmd_table)
+
         # calling the super init
         super().__init__(cls, bases, namespace)
 
@@ -102,26 +114,47 @@ class Character(control.Monoreceiver, metaclass=CharacterClass):
         self._name = name
         self.location = None
         self.inv = inventory.Inventory()
-        self.cmd_dict = CommandDict()
-
-        # add all the commands from this class
-        for cmd_class, cmd_names in self.cmd_classes.items():
-            for cmd_name in cmd_names:
-                # create the command
-                cmd = Command(cmd_name[4:], getattr(self, cmd_name), cmd_class)
-                # add the command to the command dict
-                self.cmd_dict.add_cmd(cmd)
+        # the commands from this class are shared with every other
+        # character of the class (see CharacterClass)
+        self.cmd_dict = CommandDict(self.cmd_table, self)
 
         self.equip_dict = item.EquipTarget.make_dict(*self.equip_slots)
+        # maps the names of running cooldowns to their timers
+        # (see mudscript.start_cooldown)
+        self.cooldowns = {}
         self._parser = lambda line: self.parse_command(line)
         #TODO: make this a property
         self.is_alive = True
 
+    def cancel_timers(self):
+        '''cancel every timer running for this character, such as its
+        cooldowns (done when the character leaves this process)'''
+        for timer in self.cooldowns.values():
+            if timer is not None:
+                timer.cancel()
+        self.cooldowns.clear()
+
     def message(self, msg):
         '''send a message to the controller of this character'''
         if self.controller:
             self.controller.write_msg(msg)
 
+    def send_oob(self, package, data):
+        '''send structured data to the controller of this character
+        (see Controller.write_oob)'''
+        if self.controller:
+            self.controller.write_oob(package, data)
+
+    def send_room_info(self):
+        '''send the name and visible exits of this character's location
+        as the GMCP "Room.Info" package'''
+        if self.location is None:
+            return
+        exits = [next(iter(exit)) for exit in self.location.exits
+                 if exit.visibility.permits(self)]
+        self.send_oob("Room.Info", {"name": self.location.name,
+                                    "exits": exits})
+
     def update(self):
         while self.is_alive and self.controller.has_cmd():
             line = self.controller.read_cmd().strip()
@@ -138,12 +171,20 @@ class Character(control.Monoreceiver, metaclass=CharacterClass):
             return
         if args is None:
             args = line.split(" ")
-        # TODO: match the beginning of the line with one of the cmds
-        # to allow for multi-word commands
-        cmd_name = args[0]
-        if not self.cmd_dict.has_name(cmd_name):
-            self.message("Command \'%s\' not recognized." % cmd_name)
+        args = self.cmd_dict.expand_alias(args)
+        # match the start of the line to a command, which may be
+        # abbreviated, or take up several words
+        cmd_name, length = self.cmd_dict.match(args)
+        if cmd_name is None:
+            options = self.cmd_dict.completions(args[0]) if args[0] else []
+            if len(options) > 1:
+                self.message("Command \'%s\' is ambiguous. Did you mean: %s?"
+                             % (args[0], ", ".join(options)))
+            else:
+                self.message("Command \'%s\' not recognized." % args[0])
             return
+        # the command sees its full name as the first argument
+        args = [cmd_name] + args[length:]
         cmd = self.cmd_dict.get_cmd(cmd_name)
         try:
             cmd(args)
@@ -217,6 +258,12 @@ class Character(control.Monoreceiver, metaclass=CharacterClass):
         # in the current locations
         for entity in new_location.entities:
             entity.add_cmds(self)
+        # the location belongs to another server process, so we must
+        # move there too
+        if new_location.shard is not None:
+            mudscript.migrate(self)
+        else:
+            self.send_room_info()
 
     def take_exit(self, exit, show_leave=True, leave_via=None, 
                   show_enter=True, enter_via=None):
@@ -232,7 +279,9 @@ class Character(control.Monoreceiver, metaclass=CharacterClass):
                 pass
         old_loc = self.location
         self.set_location(exit.destination)
-        self.cmd_look(["look"], verbose=False)
+        # if we are moving to another process, it will show us around
+        if self.location.shard is None:
+            self.cmd_look(["look"], verbose=False)
         if show_leave:
             try:
                 if leave_via:
@@ -282,11 +331,36 @@ class Character(control.Monoreceiver, metaclass=CharacterClass):
         if len(args) < 2:
             self.message(self.cmd_dict.help())
             return
-        name = args[1]
-        if self.cmd_dict.has_name(name):
+        name, _ = self.cmd_dict.match(args[1:])
+        if name is not None:
             self.message(str(self.cmd_dict.get_cmd(name).help()))
         else:
-            self.message("Command \'%s\' not recognized." % name)
+            self.message("Command \'%s\' not recognized." % " ".join(args[1:]))
+
+    def cmd_alias(self, args):
+        '''Create a shortcut for a command.
+        usage: alias [name] [command]
+        For example, after "alias gu go upstairs", typing "gu" is the
+        same as typing "go upstairs".
+        Use "alias" to list your aliases, and "alias [name]" to remove one.
+        '''
+        if len(args) < 2:
+            aliases = self.cmd_dict.aliases()
+            if not aliases:
+                self.message("You have no aliases.")
+                return
+            self.message("\n".join("%s: %s" % (alias, aliases[alias])
+                                   for alias in sorted(aliases)))
+        elif len(args) == 2:
+            try:
+                self.cmd_dict.remove_alias(args[1])
+                self.message("Removed alias \'%s\'." % args[1])
+            except KeyError:
+                self.message("No alias named \'%s\'." % args[1])
+        else:
+            self.cmd_dict.add_alias(args[1], " ".join(args[2:]))
+            self.message("\'%s\' now stands for \'%s\'."
+                         % (args[1], " ".join(args[2:])))
 
     def cmd_look(self, args, verbose=True):
         '''Gives description of current location
@@ -323,8 +397,10 @@ class Character(control.Monoreceiver, metaclass=CharacterClass):
         else:
             exit_msg += "None"
         self.message(exit_msg)
-        items = map(str, self.location.all_items())
-        items = util.group_and_count(list(items), format="%s(%i)", sep=", ")
+        items = [(str(item), quantity)
+                 for item, quantity in self.location.item_stacks()]
+        items = util.group_and_count(items, format="%s(%i)", sep=", ",
+                                     counted=True)
         if items:
             item_msg = "\nItems Available:\n" + items
             self.message(item_msg)
@@ -522,6 +598,9 @@ class CharFilter:
         _mode - FilterMode.WHITELIST or FilterMode.BLACKLIST
                 if WHITELIST is selected, only tracked chars are allowed in
                 if BLACKLIST is selected, tracked chars are excluded
+        _decisions - cache of the decision made for each CharacterClass,
+                     valid while _decisions_version matches _version
+                     (which include and exclude increment)
     '''
 
     def __init__(self, mode, classes=[], include_chars=[], exclude_chars=[]):
@@ -543,6 +622,9 @@ class CharFilter:
                                  " and exclude")
         self._include_chars = set(include_chars)
         self._exclude_chars = set(exclude_chars)
+        self._version = 0
+        self._decisions = {}
+        self._decisions_version = 0
         if isinstance(mode, FilterMode):
             self._mode = mode
         elif isinstance(mode, bool):
@@ -573,21 +655,36 @@ class CharFilter:
             # now try the Character's class
             other = type(other)
         if isinstance(other, CharacterClass):
-            # cycle through each ancestor
-            ancestors = filter(lambda x: isinstance(x, CharacterClass),
-                              other.__mro__)
-            for char_class in ancestors:
-                if char_class in self._classes:
-                    return self._mode.value
+            # a class always gets the same answer, until the filter
+            # is changed
+            if self._decisions_version != self._version:
+                self._decisions.clear()
+                self._decisions_version = self._version
+            try:
+                return self._decisions[other]
+            except KeyError:
+                decision = self._decide(other)
+                self._decisions[other] = decision
+                return decision
         # "other" is neither a CharClass nor Character
         else:
             return False
-        # the character / ancestors cannot be found in the list
+
+    def _decide(self, char_class):
+        '''returns True if [char_class] is allowed in, without the cache'''
+        # cycle through each ancestor
+        ancestors = filter(lambda x: isinstance(x, CharacterClass),
+                          char_class.__mro__)
+        for ancestor in ancestors:
+            if ancestor in self._classes:
+                return self._mode.value
+        # the ancestors cannot be found in the list
         return not self._mode.value
 
     def include(self, other):
         '''Set the filter to return 'True' if [other] is supplied
         to permit()'''
+        self._version += 1
         # check that other is a Character / CharacterClass
         if isinstance(other, CharacterClass):
             if self._mode is FilterMode.WHITELIST:
@@ -606,6 +703,7 @@ class CharFilter:
     def exclude(self, other):
         '''Set the filter to return 'False' if [other] is supplied
         to permit()'''
+        self._version += 1
         # check that other is a Character / CharacterClass
         if isinstance(other, CharacterClass):
             if self._mode is FilterMode.WHITELIST:
@@ -1,4 +1,5 @@
 '''module containing the CommandDict class'''
+from collections.abc import Mapping
 from util.shadowdict import ShadowDict
 
 class Command:
@@ -26,6 +27,10 @@ class Command:
     def help(self):
         return self._func.__doc__
 
+    def bind(self, source):
+        '''return a copy of this command that is called with [source]'''
+        return Command(self.name, self._func, self.type_name, source)
+
     def __repr__(self):
         return "Command%r" % ((self.name, self._func, self.type_name, self.source),)
 
@@ -68,15 +73,160 @@ class SpecificCommand(Command):
                                                self.source, self.char),)
 
 
-# TODO: improve the help menu to make it more efficient
-# options include adding indicies for CommandTypes
-# or simply caching the help menu
-class CommandDict:
-    '''dictionary that maps names (strings) to commands (functions)'''
+class _TrieNode:
+    '''a node of a CommandTrie'''
+    __slots__ = ("children", "count", "terminal")
+
     def __init__(self):
-        '''initialize a CommandDict with commands [cmds]'''
+        # maps the next character of a name to the following node
+        self.children = {}
+        # the number of names that pass through this node
+        self.count = 0
+        # true if a name ends at this node
+        self.terminal = False
+
+
+class CommandTrie:
+    '''prefix tree of command names, used to find commands from
+    abbreviations (see CommandDict.match)
+    names are walked one character at a time, so multi-word names
+    (containing spaces) need no special treatment
+    '''
+    def __init__(self, names=()):
+        self.root = _TrieNode()
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        '''add [name] to the trie, if it is not already present'''
+        if self.has_name(name):
+            return
+        node = self.root
+        node.count += 1
+        for char in name:
+            node = node.children.setdefault(char, _TrieNode())
+            node.count += 1
+        node.terminal = True
+
+    def remove(self, name):
+        '''remove [name] from the trie
+        raises a KeyError if [name] is not present'''
+        if not self.has_name(name):
+            raise KeyError(name)
+        node = self.root
+        node.count -= 1
+        for char in name:
+            child = node.children[char]
+            child.count -= 1
+            # prune the rest of the branch, if nothing else uses it
+            if not child.count:
+                del node.children[char]
+                return
+            node = child
+        node.terminal = False
+
+    def node(self, prefix):
+        '''returns the node reached by [prefix], or None'''
+        node = self.root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def has_name(self, name):
+        '''returns true if [name] is in the trie'''
+        node = self.node(name)
+        return node is not None and node.terminal
+
+    def names(self, prefix=""):
+        '''returns a sorted list of every name starting with [prefix]'''
+        found = []
+        start = self.node(prefix)
+        if start is None:
+            return found
+        stack = [(prefix, start)]
+        while stack:
+            name, node = stack.pop()
+            if node.terminal:
+                found.append(name)
+            for char, child in node.children.items():
+                stack.append((name + char, child))
+        return sorted(found)
+
+    def only_name(self, prefix, node):
+        '''returns the only name below [node], which [prefix] reaches
+        (the node must have a count of 1)'''
+        name = prefix
+        while not node.terminal:
+            char, node = next(iter(node.children.items()))
+            name += char
+        return name
+
+
+class CommandTable(Mapping):
+    '''read-only mapping of names to commands, with a trie of their names
+    a table can be shared by many CommandDicts (see CharacterClass)
+    '''
+    def __init__(self, cmds=()):
+        self._commands = {}
+        for cmd in cmds:
+            self._commands[str(cmd)] = cmd
+        self.trie = CommandTrie(self._commands)
+
+    def __getitem__(self, name):
+        return self._commands[name]
+
+    def __iter__(self):
+        return iter(self._commands)
+
+    def __len__(self):
+        return len(self._commands)
+
+    def __repr__(self):
+        return "CommandTable(%r)" % list(self._commands.values())
+
+
+# rendered help menus, shared by every CommandDict with the same commands
+# maps (width, sorted tuple of (name, type_name) pairs) to the menu
+_help_menus = {}
+# the most menus kept in _help_menus
+HELP_CACHE_SIZE = 256
+
+
+class CommandDict:
+    '''dictionary that maps names (strings) to commands (functions)
+
+    A CommandDict may be laid over a shared, read-only table of commands
+    (such as the table a CharacterClass builds for its characters). The
+    table's commands are stored unbound, and are bound to the dict's
+    source when they are looked up. Commands added to the dict shadow
+    those in the table, but the table itself is never changed, so its
+    commands cannot be removed or renamed.
+
+    Names are also kept in a prefix tree, so that a command can be found
+    from the start of a line of input with 'match', and a CommandDict
+    holds aliases (see 'add_alias').
+
+    The help menu is cached, and only rebuilt after commands are added,
+    removed or renamed. Dicts holding the same commands (characters of
+    one class, wearing the same equipment) share a single menu.
+    '''
+    def __init__(self, base=None, source=None):
+        '''initialize an empty CommandDict
+        [base] = optional CommandTable of unbound commands
+        [source] = what the commands in [base] are called with
+        '''
         self._commands = ShadowDict()
         self._command_names = {}
+        self._trie = CommandTrie()
+        self._aliases = {}
+        self._base = base if base is not None else _EMPTY_TABLE
+        self._source = source
+        # incremented whenever the commands change
+        self._version = 0
+        # the version and width of the last help menu, and the menu
+        self._help = None
 
     def add_cmd(self, cmd, name=None):
         '''add cmd to the dict with name
@@ -86,6 +236,8 @@ class CommandDict:
             name = str(cmd)
         self._commands[name] = cmd
         self._command_names[cmd] = name
+        self._trie.add(name)
+        self._version += 1
 
     #TODO: document shadowing behavior
     def remove_cmd(self, cmd):
@@ -93,6 +245,10 @@ class CommandDict:
         name = self._command_names[cmd]
         self._commands.remove_value(name, cmd)
         del self._command_names[cmd]
+        # the name may still be in use by a shadowed command
+        if name not in self._commands:
+            self._trie.remove(name)
+        self._version += 1
 
     #TODO: document shadowing behavior
     def remove_name(self, name):
@@ -100,74 +256,207 @@ class CommandDict:
         cmd = self._commands[name]
         del self._commands[name]
         del self._command_names[cmd]
+        if name not in self._commands:
+            self._trie.remove(name)
+        self._version += 1
 
     def change_name(self, current, new_name):
         '''change the name associated with a command'''
         cmd = self._commands[current]
         del self._commands[current]
+        if current not in self._commands:
+            self._trie.remove(current)
         self._commands[new_name] = cmd
         self._command_names[cmd] = new_name
+        self._trie.add(new_name)
+        self._version += 1
 
     def get_cmd(self, name):
         '''get a cmd by providing its name'''
-        return self._commands[name]
+        if name in self._commands:
+            return self._commands[name]
+        return self._base[name].bind(self._source)
 
     def get_name(self, cmd):
         '''get a name by providing the cmd'''
-        return self._command_names[cmd]
+        if cmd in self._command_names:
+            return self._command_names[cmd]
+        if self._in_base(cmd):
+            return cmd.name
+        raise KeyError(cmd)
 
     def has_name(self, name):
         '''returns true if 'name' is in use'''
-        return name in self._commands
+        return name in self._commands or name in self._base
 
     def has_cmd(self, cmd):
         '''returns true if 'cmd' exists in the dict'''
-        return cmd in self._command_names
+        return cmd in self._command_names or self._in_base(cmd)
+
+    def _in_base(self, cmd):
+        '''returns true if 'cmd' is one of the shared commands, bound to
+        this dict's source (as 'get_cmd' returns them)'''
+        base = self._base.get(str(cmd))
+        return (base is not None and cmd.source is self._source
+                and cmd._func is base._func
+                and cmd.type_name == base.type_name)
+
+    def match(self, words):
+        '''find the command named at the start of [words], a list of words
+        returns a tuple of the command's name, and the number of words
+        that named it, or (None, 0) if there is no such command
+
+        The longest name spelled out in full is preferred, so a command
+        named "pick up" wins over "pick". Otherwise, the first word may
+        be an abbreviation of a single command ("l" for "look"). The
+        names are walked a character at a time, so this costs no more
+        than the length of the input, however many commands there are.
+        '''
+        text = " ".join(words)
+        base = self._base.trie.root
+        own = self._trie.root
+        found = None
+        found_words = 0
+        for index, char in enumerate(text):
+            if char == " ":
+                found_words += 1
+            if base is not None:
+                base = base.children.get(char)
+            if own is not None:
+                own = own.children.get(char)
+            if base is None and own is None:
+                break
+            # a name must end at the end of a word
+            end = index + 1
+            if ((base is not None and base.terminal
+                 or own is not None and own.terminal)
+                    and (end == len(text) or text[end] == " ")):
+                found = (text[:end], found_words + 1)
+        if found is not None:
+            return found
+
+        # check if the first word starts exactly one name
+        prefix = words[0] if words else ""
+        if not prefix:
+            return None, 0
+        base = self._base.trie.node(prefix)
+        own = self._trie.node(prefix)
+        base_count = base.count if base is not None else 0
+        own_count = own.count if own is not None else 0
+        if base_count + own_count == 1:
+            node, trie = (base, self._base.trie) if base_count else \
+                (own, self._trie)
+            return trie.only_name(prefix, node), 1
+        # the name may be both in the table and shadowed by this dict
+        if base_count == 1 and own_count == 1:
+            name = self._trie.only_name(prefix, own)
+            if name == self._base.trie.only_name(prefix, base):
+                return name, 1
+        return None, 0
+
+    def completions(self, prefix):
+        '''returns a sorted list of every name that starts with [prefix]'''
+        names = set(self._base.trie.names(prefix))
+        names.update(self._trie.names(prefix))
+        return sorted(names)
+
+    def add_alias(self, alias, replacement):
+        '''make the word [alias] stand for [replacement] at the start of
+        a line (see 'expand_alias')'''
+        self._aliases[alias] = replacement
+
+    def remove_alias(self, alias):
+        '''remove [alias], raises a KeyError if it does not exist'''
+        del self._aliases[alias]
+
+    def aliases(self):
+        '''returns a dict mapping each alias to its replacement'''
+        return dict(self._aliases)
+
+    def expand_alias(self, words):
+        '''returns [words] (a list) with an alias in the first word
+        replaced, aliases are not expanded again after replacement'''
+        if words and words[0] in self._aliases:
+            return self._aliases[words[0]].split(" ") + words[1:]
+        return words
 
     def iter_cmds(self):
         for cmd in self._command_names:
             yield cmd
+        for cmd in self._base.values():
+            yield cmd
+
+    def items(self):
+        '''iterate over the current name, command pairs
+        commands from the shared table are left unbound'''
+        for name, cmd in self._base.items():
+            if name not in self._commands:
+                yield (name, cmd)
+        yield from self._commands.items()
 
     def help(self, width=30):
         '''produce a formatted help menu with width [width]'''
-        output = []
-
-        # TODO: improve this sorting process
-        types = {}
-        # create a type dictionary
-        for name, cmd in self._commands.items():
-            if cmd.type_name not in types:
-                types[cmd.type_name] = []
-            types[cmd.type_name].append(name)
-        typelist = list(types.keys())
-
-        # sorting through the typelist to ensure a reliable ordering
-        # TODO: find a better way of doing this
-        typelist.sort()
-        if "Default" in typelist:
-            typelist.remove("Default")
-            typelist.insert(0, "Default")
-        if "Equipped" in typelist:
-            typelist.remove("Equipped")
-            typelist.append("Equipped")
-        if "Environmental" in typelist:
-            typelist.remove("Environmental")
-            typelist.append("Environmental")
-        for typ in typelist:
-            names = types[typ]
-            output.append("{0:-^{width}}".format(typ + " Commands", width=width))
-            length = 0
-            name_row = []
-            for name in names:
-                length += len(name) + 2
-                if length >= width - 2:
-                    length = len(name)
-                    output.append("{0: ^{width}}".format("  ".join(name_row), width=width))
-                    name_row = []
-                name_row.append(name)
-            output.append("{0: ^{width}}".format("  ".join(name_row), width=width))
-        return "\n".join(output)
+        if self._help is not None and self._help[:2] == (self._version, width):
+            return self._help[2]
+        # the menu only depends on the names and types of the commands,
+        # so another dict may have built it already. They are sorted, so
+        # that the order the commands were added in doesn't matter
+        key = (width, tuple(sorted((name, cmd.type_name)
+                                   for name, cmd in self.items())))
+        menu = _help_menus.get(key)
+        if menu is None:
+            menu = _render_help(key[1], width)
+            if len(_help_menus) >= HELP_CACHE_SIZE:
+                # forget the oldest menu
+                del _help_menus[next(iter(_help_menus))]
+            _help_menus[key] = menu
+        self._help = (self._version, width, menu)
+        return menu
+
+
+def _render_help(entries, width):
+    '''format a help menu with width [width]
+    [entries] = sequence of (name, type_name) pairs, sorted by name'''
+    output = []
+
+    # TODO: improve this sorting process
+    types = {}
+    # create a type dictionary
+    for name, type_name in entries:
+        if type_name not in types:
+            types[type_name] = []
+        types[type_name].append(name)
+    typelist = list(types.keys())
+
+    # sorting through the typelist to ensure a reliable ordering
+    # TODO: find a better way of doing this
+    typelist.sort()
+    if "Default" in typelist:
+        typelist.remove("Default")
+        typelist.insert(0, "Default")
+    if "Equipped" in typelist:
+        typelist.remove("Equipped")
+        typelist.append("Equipped")
+    if "Environmental" in typelist:
+        typelist.remove("Environmental")
+        typelist.append("Environmental")
+    for typ in typelist:
+        names = types[typ]
+        output.append("{0:-^{width}}".format(typ + " Commands", width=width))
+        length = 0
+        name_row = []
+        for name in names:
+            length += len(name) + 2
+            if length >= width - 2:
+                length = len(name)
+                output.append("{0: ^{width}}".format("  ".join(name_row), width=width))
+                name_row = []
+            name_row.append(name)
+        output.append("{0: ^{width}}".format("  ".join(name_row), width=width))
+    return "\n".join(output)
+
 
+_EMPTY_TABLE = CommandTable()
 
 # def dummy_command(name, type_name):
 #     return Command(name, lambda x: x, type_name)
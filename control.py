@@ -1,5 +1,5 @@
 from abc import ABCMeta, abstractmethod
-import queue
+from collections import deque
 
 class Controller(metaclass=ABCMeta):
     '''Abstract base class for implementing a Controller
@@ -54,6 +54,13 @@ class Controller(metaclass=ABCMeta):
         '''returns true if there are commands to read'''
         pass
 
+    def write_oob(self, package, data):
+        '''writes structured [data] under the name [package], to be sent
+        out-of-band (for instance, over GMCP) alongside the messages
+        by default, this data is discarded
+        '''
+        pass
+
 
 class MultiController(Controller):
     '''A wrapper for multiple controllers
@@ -114,6 +121,11 @@ class MultiController(Controller):
         for ctrl in self:
             ctrl.write_msg(msg)
 
+    def write_oob(self, package, data):
+        '''sends out-of-band data to all controllers'''
+        for ctrl in self:
+            ctrl.write_oob(package, data)
+
     def has_msg(self):
         '''returns true if any controller has unanswered message'''
         return any(ctrl.has_msg() for ctrl in self)
@@ -126,8 +138,17 @@ class MultiController(Controller):
 
 class Player(Controller):
     '''Player class assigns Controllers to each client ID
+
+    Players are only ever used from the game loop's thread, so their
+    queues are plain deques, without the locking of a queue.Queue.
+    Unlike queue.Queue.get, read_cmd does not wait for a command to
+    arrive; check has_cmd first.
     '''
     player_ids = {}
+    # ids of players that have been written to since the last call to
+    # receive_messages (or receive_oob), so that only they are visited
+    _unsent_msgs = set()
+    _unsent_oob = set()
 
     def __init__(self, id):
         if id in self.player_ids:
@@ -135,8 +156,9 @@ class Player(Controller):
         self.id = id
         self.player_ids[id] = self
         self.receiver = None
-        self._command_queue = queue.Queue()
-        self._message_queue = queue.Queue()
+        self._command_queue = deque()
+        self._message_queue = deque()
+        self._oob_queue = deque()
 
     def poke(self):
         '''temporary method, used if running in 1 thread
@@ -154,16 +176,33 @@ class Player(Controller):
         '''returns a command from the queue
         intended to be called from self.characte    
         '''
-        return self._command_queue.get()
+        return self._command_queue.popleft()
 
     def write_msg(self, msg):
-        self._message_queue.put(msg)
+        self._message_queue.append(msg)
+        Player._unsent_msgs.add(self.id)
+
+    def write_oob(self, package, data):
+        self._oob_queue.append((package, data))
+        Player._unsent_oob.add(self.id)
 
     def has_cmd(self):
-        return not self._command_queue.empty()
+        return bool(self._command_queue)
 
     def has_msg(self):
-        return not self._message_queue.empty()
+        return bool(self._message_queue)
+
+    def drain_cmds(self):
+        '''removes and returns a list of every command in the queue'''
+        commands = list(self._command_queue)
+        self._command_queue.clear()
+        return commands
+
+    def drain_msgs(self):
+        '''removes and returns a list of every message in the queue'''
+        messages = list(self._message_queue)
+        self._message_queue.clear()
+        return messages
 
     def __str__(self):
         return "id: %s receiver: %s" % (self.id, self.receiver)
@@ -176,21 +215,39 @@ class Player(Controller):
         will send the command to the appropriate's player's queue
         ''' 
         player = Player.player_ids[id]
-        player._command_queue.put(command)
+        player._command_queue.append(command)
         #this must be done in the non-threaded version
         #otherwise, the Character will never do anything
         player.poke()
 
     @classmethod
     def receive_messages(self):
-        '''iterates over every player, yielding ids and messages
-        note that this method is costly, and it might make 
-        more since to make Player.message_queue containg these
-        tuples
+        '''iterates over every player with new messages, yielding ids
+        and messages
+        only players written to since the last call are visited, so the
+        cost depends on how many players were messaged, not on how many
+        players there are
         '''
-        for id, player in Player.player_ids.items():
-            while player.has_msg():
-                yield (id, player._message_queue.get())
+        unsent, Player._unsent_msgs = Player._unsent_msgs, set()
+        for id in unsent:
+            player = Player.player_ids.get(id)
+            # the player may have been removed since
+            if player is not None:
+                for msg in player.drain_msgs():
+                    yield (id, msg)
+
+    @classmethod
+    def receive_oob(self):
+        '''iterates over every player with new out-of-band data, yielding
+        ids, packages and data written with write_oob
+        '''
+        unsent, Player._unsent_oob = Player._unsent_oob, set()
+        for id in unsent:
+            player = Player.player_ids.get(id)
+            if player is not None:
+                while player._oob_queue:
+                    package, data = player._oob_queue.popleft()
+                    yield (id, package, data)
 
     @classmethod
     def remove_player(self, id):
@@ -203,6 +260,8 @@ class Player(Controller):
             # self.character is most likely None
             pass
         del Player.player_ids[id]
+        Player._unsent_msgs.discard(id)
+        Player._unsent_oob.discard(id)
 
 
 #TODO: implement a system for creating nonplayers based on file
@@ -313,10 +372,10 @@ class Multireceiver(Monoreceiver):
         def __init__(self, multireceiver, receiver):
             self.multireceiver = multireceiver
             self.receiver = receiver
-            self._command_queue = queue.Queue()
+            self._command_queue = deque()
 
         def has_cmd(self):
-            return not self._command_queue.empty()
+            return bool(self._command_queue)
 
         def has_msg(self):
             try: 
@@ -326,17 +385,26 @@ class Multireceiver(Monoreceiver):
                 pass
 
         def read_cmd(self):
-            return self._command_queue.get()
+            return self._command_queue.popleft()
+
+        def drain_cmds(self):
+            commands = list(self._command_queue)
+            self._command_queue.clear()
+            return commands
 
         def add_cmd(self, cmd):
-            self._command_queue.put(cmd)
+            self._command_queue.append(cmd)
 
         def write_msg(self, msg):
             self.multireceiver._message(self.receiver, msg)
 
+        def write_oob(self, package, data):
+            if self.multireceiver.controller is not None:
+                self.multireceiver.controller.write_oob(package, data)
+
     def __init__(self, *subreceivers, **kwargs):
         self.controller = None
-        self.messages = queue.Queue()
+        self.messages = deque()
         self._sub_dict = {}
         for sub in subreceivers:
             assert(isinstance(sub, Receiver))
@@ -1,30 +1,80 @@
 '''defining the inventory module'''
+from itertools import repeat
+
+class _Stack:
+    '''All the items in an inventory that share a type and name
+    Stackable items are stateless, so a stack of them keeps a single
+    (flyweight) instance and a count. Other items are kept as a list
+    of distinct instances, and the count is simply their number.
+    '''
+    __slots__ = ("items", "count")
+
+    def __init__(self):
+        self.items = []
+        self.count = 0
+
+    @property
+    def top(self):
+        '''the item returned by find, and shown for the stack'''
+        return self.items[-1]
+
+    def add(self, item, quantity):
+        if getattr(item, "stackable", False):
+            if not self.items:
+                self.items.append(item)
+        else:
+            self.items += [item] * quantity
+        self.count += quantity
+
+    def remove(self, item, quantity):
+        if not getattr(item, "stackable", False):
+            del self.items[-quantity:]
+        self.count -= quantity
+        if not self.count:
+            self.items.clear()
+
+    def __iter__(self):
+        '''iterate over every unit in the stack'''
+        if len(self.items) == self.count:
+            return iter(self.items)
+        return repeat(self.items[-1], self.count)
+
 
-#TODO: make internal implementation faster and more elegant
 class Inventory:
     '''Inventory for containing items, stacking by quantity
     all items are stored in _items, which follows this layout
     {
-        item_type : { item_key : quantity }
+        item_type : { item_key : _Stack }
+    }
+    the stacks are also indexed by their casefolded item names in
+    _index, so that find does not need to check every stack
+    {
+        casefolded item_key : [_Stack, ...]
     }
     '''
     def __init__(self, *items): 
         self._items = {}
+        self._index = {}
         for item in items:
             self.add_item(item)
 
     def add_item(self, item, quantity=1):
         '''adds an [item] of [quantity] to this inventory
         default quantity = 1
+        if the item is stackable, [item] is shared by the whole stack
         '''
         item_type = item.item_type
         name = item.name
         if item_type not in self._items:
             self._items[item_type] = {}
-        if name not in self._items[item.item_type]:
-            self._items[item_type][name] = [item] * quantity
-        else:
-            self._items[item_type][name] += [item] * quantity
+        if name not in self._items[item_type]:
+            stack = self._items[item_type][name] = _Stack()
+            key = name.casefold()
+            if key in self._index:
+                self._index[key].append(stack)
+            else:
+                self._index[key] = [stack]
+        self._items[item_type][name].add(item, quantity)
 
     def remove_item(self, item, quantity=1):
         '''removes an [item] of [quantity] to this inventory
@@ -37,29 +87,47 @@ class Inventory:
             raise KeyError("Item %s not found" % item)
         if name not in self._items[item_type]:
             raise KeyError("Item %s not found" % item)
-        if len(self._items[item_type][name]) < quantity:
+        stack = self._items[item_type][name]
+        if stack.count < quantity:
             raise ArithmeticError("Attempted to remove too many items")
-        self._items[item_type][name]
-        del self._items[item_type][name][-quantity:]
-        if not self._items[item_type][name]:
+        stack.remove(item, quantity)
+        if not stack.count:
             del self._items[item_type][name]
+            key = name.casefold()
+            stacks = self._index[key]
+            stacks.remove(stack)
+            if not stacks:
+                del self._index[key]
         if not self._items[item_type]:
             del self._items[item_type]
         return item
 
     def find(self, name):
-        '''Return all items with a matching name'''
-        for name_list in self._items.values():
-            for item_name, item_list in name_list.items():
-                if name.lower() == item_name.lower():
-                    return item_list[-1]
+        '''Return an item with a matching name (ignoring case),
+        or None if there is no such item'''
+        stacks = self._index.get(name.casefold())
+        if stacks:
+            return stacks[0].top
+
+    def count(self, item):
+        '''returns the number of [item] in this inventory'''
+        try:
+            return self._items[item.item_type][item.name].count
+        except KeyError:
+            return 0
+
+    def stacks(self):
+        '''iterate over (item, quantity) pairs, one per stack'''
+        for name_dict in self._items.values():
+            for stack in name_dict.values():
+                yield stack.top, stack.count
 
     def readable(self):
         output = ""
         for item_type in self._items:
             output += item_type + "\n"
-            for item, lst in self._items[item_type].items():
-                output += "\t%s: %s\n" % (item, len(lst))
+            for item, stack in self._items[item_type].items():
+                output += "\t%s: %s\n" % (item, stack.count)
         return output
 
     def __iadd__(self, item):
@@ -73,16 +141,17 @@ class Inventory:
         return self
 
     def __iter__(self):
-        '''iterate over item in _items'''
+        '''iterate over item in _items
+        (a stack of stackable items yields its instance once per unit)'''
         for name_dict in self._items.values():
-            for item_list in name_dict.values():
-                for item in item_list:
-                    yield item
+            for stack in name_dict.values():
+                yield from stack
 
     def __repr__(self):
         return "Inventory(%s)" % " ,".join(map(repr,self))
 
     def __contains__(self, item):
-        if type(type(item)) in self._items:
-            return item in self._items[type(type(item))]
-        return False
\ No newline at end of file
+        try:
+            return item.name in self._items[item.item_type]
+        except KeyError:
+            return False
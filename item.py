@@ -13,6 +13,16 @@ import character
 
 class Item(type):
     '''Metaclass establishing behavior for all items'''
+    def __new__(cls, name, bases, namespace):
+        '''stackable items are stateless, so unless they ask for
+        otherwise, their instances are given no __dict__'''
+        stackable = namespace.get("stackable",
+                                  any(getattr(base, "stackable", False)
+                                      for base in bases))
+        if stackable and "__slots__" not in namespace:
+            namespace["__slots__"] = ()
+        return super().__new__(cls, name, bases, namespace)
+
     def __init__(self, cls, bases, namespace):
         if "_item_name" not in namespace:
             self._item_name = camel_to_space(cls)
@@ -25,6 +35,25 @@ class Item(type):
         return self._item_name
 
 
+# instances of stackable items, shared by make_item
+_shared_items = {}
+
+
+def make_item(item_class):
+    '''return an instance of [item_class]
+    stackable items are stateless, so every call returns the same
+    (flyweight) instance for a stackable class
+    other classes get a new instance from each call
+    '''
+    if not getattr(item_class, "stackable", False):
+        return item_class()
+    try:
+        return _shared_items[item_class]
+    except KeyError:
+        instance = _shared_items[item_class] = item_class()
+        return instance
+
+
 class EquipCommand(SpecificCommand):
     """SpecificCommand with the type set to 'Equipped'"""
     def __init__(self, name, func, type_name="Equipped", filter=None, 
@@ -68,7 +97,8 @@ class EquippableBase(metaclass=Equippable):
     '''Base class for all Equippable items
     You must define your own "target", "equip", and "unequip" methods
     '''
-
+    # equipped items may be given state, so each is kept distinct
+    stackable = False
 
     @property
     def name(self):
@@ -184,7 +214,11 @@ class Usable(Item):
 class UsableBase(metaclass=Usable):
     '''Base class for all Usable items
     You must define your own "use" methods
+    Subclasses that keep no per-instance state may set stackable to
+    True, to be stacked and given no __dict__ like MiscItems
     '''
+    __slots__ = ()
+    stackable = False
 
     @property
     def name(self):
@@ -211,7 +245,15 @@ class MiscItemBase(metaclass=Item):
     '''Base class for all MiscItems
     These items cannot be used, and will be typically
     used to store value (e.g. money, gold, building materials)
+    MiscItems are stateless, so inventories stack them: one instance
+    stands for every unit of the item (see inventory.Inventory)
+    Their name (and any description) belong to the class, and
+    instances have no __dict__.
+    Subclasses that do keep per-instance state should set
+    stackable to False.
     '''
+    __slots__ = ()
+    stackable = True
 
     @property
     def name(self):
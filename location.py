@@ -1,6 +1,7 @@
 import inventory as inv
 import item
 import character
+from util.broadcast import Broadcast
 
 class Exit:
     '''Class representing an Exit
@@ -87,21 +88,50 @@ class Location:
     Maintains a list of players
     Contains a list of exits to other locations
     Has a name and description
+    Characters and exits are also indexed by their (casefolded) names,
+    as are items (by the location's inventory), so that finding one by
+    name does not depend on how crowded the location is
     '''
 
+    # number of the shard process that owns this location, if the world
+    # is split across several processes and this one does not own it
+    # (see shard.py)
+    shard = None
+
     def __init__(self, name, description):
         self._character_list = []
         self._entity_list = []
         self._exit_list = []
         self._items = inv.Inventory()
+        # maps names to a list of the characters with that name
+        self._char_index = {}
+        # maps every name of every exit to the exit
+        self._exit_index = {}
         self.name = name
         self.description = description
 
     def add_char(self, char):
         self._character_list.append(char)
+        key = str(char).casefold()
+        if key in self._char_index:
+            self._char_index[key].append(char)
+        else:
+            self._char_index[key] = [char]
 
     def remove_char(self, char):
         self._character_list.remove(char)
+        key = str(char).casefold()
+        chars = self._char_index[key]
+        chars.remove(char)
+        if not chars:
+            del self._char_index[key]
+
+    def find_char(self, name):
+        '''returns the first character to arrive with name [name]
+        (ignoring case), or None if there is no such character'''
+        chars = self._char_index.get(name.casefold())
+        if chars:
+            return chars[0]
 
     @property
     def characters(self):
@@ -121,6 +151,8 @@ class Location:
 
     def message_chars(self, msg):
         '''send message to all characters currently in location'''
+        # the message is encoded once for all of the characters' players
+        msg = Broadcast(msg)
         for char in self._character_list:
             char.message(msg)
 
@@ -132,9 +164,11 @@ class Location:
     def add_exit(self, exit_to_add):
         '''adds an exit, while performing a check for any ambigious names'''
         for exit_name in exit_to_add:
-            assert exit_name not in self._exit_list, \
+            assert exit_name.casefold() not in self._exit_index, \
             "\nLocation:\t%s\nExit:\t\t%s" % (self.name, exit_to_add)
         self._exit_list.append(exit_to_add)
+        for exit_name in exit_to_add:
+            self._exit_index[exit_name.casefold()] = exit_to_add
 
     def exit_list(self):
         '''returns a copy of private exit list'''
@@ -149,6 +183,10 @@ class Location:
     def all_items(self):
         return list(self._items)
 
+    def item_stacks(self):
+        '''returns a list of (item, quantity) pairs, one per stack'''
+        return list(self._items.stacks())
+
     def __contains__(self, other):
         '''Overriding in operator
         Returns True where
@@ -163,30 +201,28 @@ class Location:
             return other in self._exit_list
         elif isinstance(other, character.Character):
             return other in self._character_list
-        elif isinstance(other, item.Item):
+        elif isinstance(type(other), item.Item):
             return other in self._items
         else:
             raise ValueError("Received %s, expected Exit, Character, or Item"
                              % type(other))
 
     def find(self, query):
-        str_char_list = list(map(str, self._character_list))
-        for char in str_char_list:
-            if query == char:
-                return self._character_list[str_char_list.index(char)]
-        for exit_name in self._exit_list:
-            if exit_name == query:
-                return exit_name
-        item_result = self._items.find(query)
-        if item_result:
-            return item_result
+        '''returns the character, exit or item (checked in that order)
+        named [query], ignoring case
+        returns 'None' if nothing is found'''
+        key = query.casefold()
+        chars = self._char_index.get(key)
+        if chars:
+            return chars[0]
+        if key in self._exit_index:
+            return self._exit_index[key]
+        return self._items.find(query)
 
     def find_exit(self, exit_name):
-        '''returns an exit corresponding to exit name
+        '''returns an exit corresponding to exit name (ignoring case)
         returns 'None' if no exit is found'''
-        for exit in self._exit_list:
-            if exit_name == exit:
-                return exit
+        return self._exit_index.get(exit_name.casefold())
 
     def info(self):
         '''return a string containing detailed information'''
@@ -8,6 +8,7 @@ from location import Location, Exit
 from util.stocstring import StocString
 from util.distr import RandDist
 from character import CharFilter
+from item import make_item
 
 
 def process_yaml(filename):
@@ -438,10 +439,14 @@ class LocationImporter(Importer):
             self.warnings[loc.name].append("Could not find item"
                                            " named '%s'." % item_name)
             return
-        # we add a new instance of Item [quantity] times
-        # this is done so that two users don't wind up sharing state somehow
-        for i in range(quantity):
-            loc.add_item(Item())
+        # stateless items are stacked, so one shared instance stands for all
+        # of them; other items get a new instance each, so that two users
+        # don't wind up sharing state somehow
+        if getattr(Item, "stackable", False):
+            loc.add_item(make_item(Item), quantity)
+        else:
+            for i in range(quantity):
+                loc.add_item(Item())
 
 
     def add_entities(self, loc_names, entities):
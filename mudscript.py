@@ -63,4 +63,52 @@ def get_char_class(key):
 def message_all(msg):
     '''send message to all players'''
     global server
-    server.send_message_to_all(msg)
\ No newline at end of file
+    server.send_message_to_all(msg)
+
+@server_warning
+def schedule(delay, callback, *args):
+    '''call callback(*args) after [delay] seconds
+    returns a timer that can be passed to cancel and reschedule'''
+    global server
+    return server.timers.schedule(delay, callback, *args)
+
+@server_warning
+def repeat(period, callback, *args):
+    '''call callback(*args) every [period] seconds
+    returns a timer that can be passed to cancel to stop the calls'''
+    global server
+    return server.timers.repeat(period, callback, *args)
+
+@server_warning
+def cancel(timer):
+    '''cancel a timer created by schedule'''
+    global server
+    server.timers.cancel(timer)
+
+@server_warning
+def reschedule(timer, delay):
+    '''move a timer created by schedule to expire [delay] seconds from now'''
+    global server
+    server.timers.reschedule(timer, delay)
+
+def on_cooldown(char, name):
+    '''returns True if cooldown [name] is running for [char]'''
+    return name in char.cooldowns
+
+@server_warning
+def start_cooldown(char, name, delay):
+    '''start cooldown [name] on [char], lasting [delay] seconds
+    returns False (and does nothing) if the cooldown is already running'''
+    global server
+    if name in char.cooldowns:
+        return False
+    char.cooldowns[name] = server.timers.schedule(delay, char.cooldowns.pop,
+                                                  name, None)
+    return True
+
+@server_warning
+def migrate(char):
+    '''hand [char] and its player over to the server process that owns
+    the character's location (see shard.py)'''
+    global server
+    server.migrate(char)
@@ -7,20 +7,27 @@ server running then used to send and receive messages from players.
 author: Mark Frimston - mfrimston@gmail.com
 """
 import socket
-import select
+import selectors
 import time
 import sys
 import enum
+import struct
+import zlib
+import json
 import logging
-from collections import deque
+from collections import deque, Counter
 from numbers import Number
 from location import Location
+from util.timerwheel import TimerWheel
+from util.broadcast import Broadcast
 
 #creating an Enum for EventTypes
 class EventType(enum.Enum):
     PLAYER_JOIN = 0
     MESSAGE_RECEIVED = 1
     PLAYER_DISCONNECT = 2
+    PLAYER_AFK = 3
+    PLAYER_RETURN = 4
 
 #possibly change this to a dict, it might be more pythonic that way
 class Event:
@@ -60,27 +67,64 @@ class MudServer(object):
         # the ip address of this client
         address = ""
         # holds data send from the client until a full message is received
-        buffer = ""
-        # the last time we checked if the client was still connected
-        lastcheck = 0
-
-        def __init__(self, socket, address, buffer, lastcheck):
+        buffer = None
+        # holds the start of a Telnet command that was split across packets
+        pending = b""
+        # True while skipping the rest of an oversized subnegotiation
+        discarding = False
+        # the last time (time.monotonic) the client sent us anything
+        last_active = 0
+        # True if the client has been idle long enough to be marked away
+        afk = False
+        # timer that will next check whether the client is idle
+        idle_timer = None
+        # holds encoded data waiting to be written to the socket
+        outbox = None
+        # the events (read / write) the selector is watching this socket for
+        interest = 0
+        # complete lines received from the client, waiting to become events
+        commands = None
+        # the time at which outbox passed the high watermark (or None)
+        stalled_since = None
+        # number of game messages dropped since the client stalled
+        dropped = 0
+        # zlib stream compressing everything sent to the client, once it
+        # has agreed to MCCP2 compression (see _handle_negotiation)
+        compressor = None
+        # holds encoded data waiting to be compressed into the outbox
+        staged = None
+        # bytes given to the compressor, bytes that came out, and the
+        # seconds of CPU time spent compressing
+        raw_bytes = 0
+        compressed_bytes = 0
+        compress_time = 0.0
+        # whether the client has agreed to receive GMCP messages
+        gmcp = False
+        # GMCP data waiting for the next flush, and the data last sent,
+        # for each package (see send_gmcp)
+        gmcp_pending = None
+        gmcp_sent = None
+        # the options we offered that the client has answered, agreeing or
+        # refusing, so they are not offered again (see _add_client)
+        answered = None
+
+        def __init__(self, socket, address, buffer, last_active):
             self.socket = socket
             self.address = address
-            self.buffer = buffer
-            self.lastcheck = lastcheck
+            self.buffer = bytearray(buffer)
+            self.last_active = last_active
+            self.outbox = bytearray()
+            self.staged = bytearray()
+            self.commands = deque()
+            self.gmcp_pending = {}
+            self.gmcp_sent = {}
+            self.answered = set()
 
     # Used to store different types of occurences
     _EVENT_NEW_PLAYER = 1
     _EVENT_PLAYER_LEFT = 2
     _EVENT_COMMAND = 3
 
-    # Different states we can be in while reading data from client
-    # See _process_sent_data function
-    _READ_STATE_NORMAL = 1
-    _READ_STATE_COMMAND = 2
-    _READ_STATE_SUBNEG = 3
-
     # Command codes used by Telnet protocol
     # See _process_sent_data function
     _TN_INTERPRET_AS_COMMAND = 255
@@ -91,6 +135,16 @@ class MudServer(object):
     _TN_DONT = 254
     _TN_SUBNEGOTIATION_START = 250
     _TN_SUBNEGOTIATION_END = 240
+    # Telnet option for MUD Client Compression Protocol v2
+    _TN_COMPRESS2 = 86
+    # Telnet option for the Generic MUD Communication Protocol
+    _TN_GMCP = 201
+
+    # Byte strings used to scan received data. See _process_sent_data
+    _IAC = b"\xff"
+    _IAC_SE = b"\xff\xf0"
+    # the longest subnegotiation we will buffer while waiting for its end
+    _MAX_SUBNEGOTIATION = 8192
 
     # socket used to listen for new clients
     _listen_socket = None
@@ -103,16 +157,133 @@ class MudServer(object):
     # list of newly-added occurences
     _new_events = []
 
-    def __init__(self, port=1234):
+    # Default limits on the data waiting to be sent to a client
+    # See _attempt_send function
+    HIGH_WATER = 64 * 1024
+    LOW_WATER = 16 * 1024
+    STALL_TIMEOUT = 30.0
+
+    # Default limits on the commands received from a client
+    # See _release_commands function
+    MAX_COMMANDS = 10
+    MAX_BACKLOG = 200
+
+    # Default settings for detecting idle and dead clients
+    # See _check_idle function
+    AFK_TIMEOUT = 10 * 60.0
+    IDLE_TIMEOUT = 60 * 60.0
+    # TCP keepalive: seconds of silence before the operating system starts
+    # probing a connection, seconds between probes, and failed probes
+    # before the connection is dropped
+    KEEPALIVE = (60, 15, 4)
+
+    # Default settings for accepting new clients
+    # See _check_for_new_connections function
+    BACKLOG = 1024
+    MAX_ACCEPTS = 64
+    # each address may connect this many times in a burst, and then
+    # this many times per period (in seconds)
+    CONNECTION_RATE = (30, 60.0)
+
+    # Default zlib level for compressing data sent to clients
+    # See _handle_negotiation function
+    COMPRESSION = 6
+
+    def __init__(self, port=1234, high_water=HIGH_WATER, low_water=LOW_WATER,
+                 stall_timeout=STALL_TIMEOUT, max_commands=MAX_COMMANDS,
+                 max_backlog=MAX_BACKLOG, afk_timeout=AFK_TIMEOUT,
+                 idle_timeout=IDLE_TIMEOUT, keepalive=KEEPALIVE,
+                 reuse_port=False, backlog=BACKLOG, max_accepts=MAX_ACCEPTS,
+                 connection_rate=CONNECTION_RATE, compression=COMPRESSION,
+                 gmcp=True):
         """Constructs the MudServer object and starts listening for
         new players.
             port - port for the server to use [default: 1234]
+            high_water - once this many bytes are waiting to be sent to
+                         a client, further messages to it are dropped
+                         [default: 64 KiB]
+            low_water - once a stalled client has fewer bytes than this
+                        waiting, it receives messages again
+                        [default: 16 KiB]
+            stall_timeout - seconds a client may stay above the high
+                            watermark before it is disconnected
+                            [default: 30]
+            max_commands - the most commands released from each client
+                           per update [default: 10]
+            max_backlog - once this many commands are waiting from a
+                          client, we stop reading from it until it
+                          catches up [default: 200]
+            afk_timeout - seconds without input before a client is marked
+                          as away, or None to never mark clients
+                          [default: 10 minutes]
+            idle_timeout - seconds without input before a client is
+                           disconnected, or None to never disconnect
+                           idle clients [default: 1 hour]
+            keepalive - TCP keepalive settings as (idle, interval, count),
+                        or None to disable keepalive [default: (60, 15, 4)]
+            reuse_port - if True, several processes may listen on the
+                         same port, and the operating system divides new
+                         connections between them [default: False]
+            backlog - the number of connections the operating system will
+                      hold for us until we accept them [default: 1024]
+            max_accepts - the most new clients accepted per update
+                          [default: 64]
+            connection_rate - limits how often each address can connect,
+                              as (count, period): bursts of up to 'count'
+                              connections, then 'count' per 'period'
+                              seconds. None disables the limit
+                              [default: (30, 60.0)]
+            compression - zlib level (1 to 9) used to compress data for
+                          clients that support MCCP2, or None to not
+                          offer compression [default: 6]
+            gmcp - whether to offer clients structured data over GMCP
+                   (see send_gmcp) [default: True]
         """
 
         self._clients = {}
         self._nextid = 0
         self._events = []
         self._new_events = []
+        self._high_water = high_water
+        self._low_water = low_water
+        self._stall_timeout = stall_timeout
+        self._max_commands = max_commands
+        self._max_backlog = max_backlog
+        # ids of the clients currently above the high watermark
+        self._stalled = set()
+        # ids of the clients with commands waiting to be released
+        self._backlogged = set()
+        self._afk_timeout = afk_timeout
+        self._idle_timeout = idle_timeout
+        self._keepalive = keepalive
+        self._reuse_port = reuse_port
+        self._backlog = backlog
+        self._max_accepts = max_accepts
+        self._connection_rate = connection_rate
+        self._compression = compression
+        self._gmcp = gmcp
+        # maps addresses to (allowance, time) for rate limiting
+        # (see _allow_connection)
+        self._allowances = {}
+        self._purge_timer = None
+        # extra files (such as pipes to other processes) polled alongside
+        # the clients, mapped to the function called when they are readable
+        self._readers = {}
+        # timers for checking idle clients. Only clients whose deadline has
+        # passed are examined, instead of every client on every update
+        self._idle_timers = TimerWheel(resolution=1.0, clock=time.monotonic)
+        # ids of the clients with messages queued since the last flush
+        # and the number of messages queued
+        self._unflushed = set()
+        self._queued = 0
+        # running totals, such as messages queued and socket writes made
+        self.stats = Counter()
+        # using a deque for the event queue
+        self.server_queue = deque()
+
+        self._start_listening(port)
+
+    def _start_listening(self, port):
 
         logging.debug("Starting listening socket.")
 
@@ -120,9 +291,16 @@ class MudServer(object):
         self._listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
         # set a special option on the socket which allows the port to be
-        # immediately without having to wait
-        # self._listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR,
-        #                                1)
+        # reused immediately without having to wait
+        self._listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR,
+                                       1)
+
+        # allow other processes to listen on the same port
+        if self._reuse_port:
+            if not hasattr(socket, "SO_REUSEPORT"):
+                raise OSError("SO_REUSEPORT is not supported on this platform")
+            self._listen_socket.setsockopt(socket.SOL_SOCKET,
+                                           socket.SO_REUSEPORT, 1)
 
         # bind the socket to an ip address and port. Port 23 is the standard
         # telnet port which telnet clients will use, however on some platforms
@@ -137,25 +315,59 @@ class MudServer(object):
         # will return immediately without waiting for a connection
         self._listen_socket.setblocking(False)
 
-        # start listening for connections on the socket
-        self._listen_socket.listen(1)
+        # start listening for connections on the socket. The backlog lets
+        # a crowd of clients (say, reconnecting after a restart) wait for
+        # us, rather than being turned away
+        self._listen_socket.listen(self._backlog)
+
+        # the selector tracks every socket we own, so that a single poll in
+        # 'update' tells us exactly which sockets are ready. Each client
+        # socket is registered with its client id as the key's data
+        # (see _check_for_new_connections)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listen_socket, selectors.EVENT_READ)
+
+        # a connected pair of sockets used to interrupt a blocking 'update'
+        # from another thread (the self-pipe trick). Writing a byte to
+        # _wakeup_send makes _wakeup_recv readable, which ends the poll
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ)
 
         logging.info("Listening on " + ":".join(map(str, self._listen_socket.getsockname())))
-        # using a deque for the event queue
-        self.server_queue = deque()
 
-    def update(self):
+    def update(self, timeout=0):
         """Checks for new players, disconnected players, and new
         messages sent from players. This method must be called before
         up-to-date info can be obtained from the 'get_new_players',
         'get_disconnected_players' and 'get_commands' methods.
         It should be called in a loop to keep the game running.
+            timeout - seconds to wait for a socket to become ready
+                      [default: 0, return immediately]
         """
 
+        # send everything queued since the last update before we wait
+        self.flush()
+
+        # if commands are still waiting from the last update, don't wait
+        if self._backlogged:
+            timeout = 0
+
+        # poll every registered socket at once. Only the sockets that are
+        # actually ready are returned, so an idle server costs one syscall
+        # per update, no matter how many clients are connected
+        ready = self._selector.select(timeout)
+
         # check for new stuff
-        self._check_for_new_connections()
-        self._check_for_disconnected()
-        self._check_for_messages()
+        self._check_for_wakeup(ready)
+        self._check_for_readers(ready)
+        self._check_for_new_connections(ready)
+        self._check_for_writable(ready)
+        self._check_for_stalled()
+        self._idle_timers.advance()
+        self._check_for_messages(ready)
+        self._release_commands()
 
         # move the new events into the main events list so that they can be
         # obtained with 'get_new_players', 'get_disconnected_players' and
@@ -215,14 +427,191 @@ class MudServer(object):
         printed out in the player's terminal.
         """
         # we make sure to put a newline on the end so the client receives the
-        # message on its own line
-        self._attempt_send(to, message+"\n\r")
+        # message on its own line. A Broadcast is encoded once, and every
+        # recipient shares the result
+        if isinstance(message, Broadcast):
+            self._attempt_send(to, message.encode_line())
+        else:
+            self._attempt_send(to, message+"\n\r")
+
+    def flush(self):
+        """Writes out every message queued since the last flush. All of
+        the messages queued for a client are joined and sent with a
+        single write. This is called at the start of each 'update', but
+        may be called earlier to send messages immediately.
+        """
+        if not self._unflushed:
+            return
+        messages, self._queued = self._queued, 0
+        writes = self.stats["writes"]
+        # flushing may queue more messages (such as a notice of dropped
+        # messages), which will go out on the next flush
+        unflushed, self._unflushed = self._unflushed, set()
+        for clid in unflushed:
+            cl = self._clients.get(clid)
+            if cl is None:
+                continue
+            # GMCP updates since the last flush go out with the messages
+            # (a stalled client gets them once it catches up)
+            if cl.gmcp_pending and cl.stalled_since is None:
+                messages += self._write_gmcp(cl)
+            self._flush_client(clid, cl)
+        # every message after the first in a batch is a write we avoided
+        writes = self.stats["writes"] - writes
+        self.stats["writes_saved"] += messages - writes
+        self.stats["flushes"] += 1
+        logging.debug("Flushed %i messages in %i writes." % (messages, writes))
+
+    def send_gmcp(self, to, package, data):
+        """Sends 'data' (any JSON-friendly value) to the player with the
+        id number given in the 'to' parameter, as the GMCP package named
+        'package' (for example "Char.Vitals"). Clients that have not
+        agreed to GMCP are skipped.
+        Only changes are sent. If 'data' is a dict, keys holding the same
+        values as last time are left out, and nothing is sent when no
+        keys have changed. Updates to a package are merged until the next
+        flush, so each client gets at most one message per package on
+        each update.
+        """
+        cl = self._clients.get(to)
+        if cl is None or not cl.gmcp:
+            return
+        sent = cl.gmcp_sent.get(package)
+        if isinstance(data, dict):
+            if not isinstance(sent, dict):
+                sent = {}
+            pending = cl.gmcp_pending.get(package)
+            if not isinstance(pending, dict):
+                pending = {}
+            for key, value in data.items():
+                if key in sent and sent[key] == value:
+                    # changed back before it was sent
+                    pending.pop(key, None)
+                else:
+                    pending[key] = value
+            if not pending:
+                cl.gmcp_pending.pop(package, None)
+                return
+            cl.gmcp_pending[package] = pending
+        elif package in cl.gmcp_sent and data == sent:
+            cl.gmcp_pending.pop(package, None)
+            return
+        else:
+            cl.gmcp_pending[package] = data
+        self._unflushed.add(to)
+        self.stats["gmcp_updates"] += 1
 
     def send_message_to_all(self, message):
         """Sends the text in the 'message' parameter to every player that
         is connected to the server"""
+        data = Broadcast(message).encode_line()
         for client in list(self._clients):
-            self.send_message(client, message)
+            self._attempt_send(client, data)
+
+    def wakeup(self):
+        """Interrupts a blocking call to 'update', causing it to return
+        early. Unlike the rest of the server, this method is safe to call
+        from other threads.
+        """
+        try:
+            self._wakeup_send.send(b"\x00")
+        except (BlockingIOError, OSError):
+            # the pipe is already full (so a wakeup is pending anyway), or
+            # the server has been shut down
+            pass
+
+    def add_reader(self, fileobj, callback):
+        """Polls 'fileobj' along with the clients, calling 'callback'
+        with no arguments from 'update' whenever it is readable.
+        """
+        self._readers[fileobj] = callback
+        self._selector.register(fileobj, selectors.EVENT_READ)
+
+    def remove_reader(self, fileobj):
+        """Stops polling a file added with 'add_reader'."""
+        del self._readers[fileobj]
+        self._selector.unregister(fileobj)
+
+    def adopt_client(self, sock, address, outbox=b"", commands=(),
+                     options=()):
+        """Takes over a client socket that was connected elsewhere (for
+        instance, released by another server process). Unlike a new
+        connection, no PLAYER_JOIN event is generated.
+            outbox - data still to be sent to the client
+            commands - commands already received from the client, which
+                       are released like any others
+            options - (option, agreed) pairs for the Telnet options the
+                      client has already answered, as returned by
+                      'release_client'
+        Returns the client's new id number.
+        """
+        sock.setblocking(False)
+        cl = self._Client(sock, address, b"", time.monotonic())
+        cl.outbox += outbox
+        cl.commands.extend(commands)
+        # pick up where the client's last server left off, rather than
+        # offering options the client has already answered
+        for option, agreed in options:
+            cl.answered.add(option)
+            if not agreed:
+                continue
+            if option == self._TN_COMPRESS2 and self._compression is not None:
+                self._start_compression(cl)
+            elif option == self._TN_GMCP and self._gmcp:
+                cl.gmcp = True
+        clid = self._add_client(cl, announce=False)
+        if cl.commands:
+            self._backlogged.add(clid)
+        if cl.outbox:
+            self._unflushed.add(clid)
+        return clid
+
+    def release_client(self, clid):
+        """Removes the client with id 'clid' from the server without
+        disconnecting it, so that its socket can be handed to something
+        else. No PLAYER_DISCONNECT event is generated.
+        Returns a tuple of the client's socket, its address, any data
+        that could not be sent yet, any commands not yet released, and
+        a list of (option, agreed) pairs for the Telnet options the client
+        has answered, or None if the client has already disconnected.
+        """
+        cl = self._clients.get(clid)
+        if cl is None:
+            return None
+        agreed = set()
+        # the compressed stream can't be carried on elsewhere, so we end it
+        # (the new owner starts a new one)
+        if cl.compressor is not None:
+            self._end_compression(cl)
+            agreed.add(self._TN_COMPRESS2)
+        if cl.gmcp:
+            agreed.add(self._TN_GMCP)
+        options = [(option, option in agreed) for option in cl.answered]
+        self._flush_client(clid, cl)
+        # the client may have hung up while we flushed
+        if clid not in self._clients:
+            return None
+        del self._clients[clid]
+        self._stalled.discard(clid)
+        self._backlogged.discard(clid)
+        self._unflushed.discard(clid)
+        if cl.idle_timer is not None:
+            self._idle_timers.cancel(cl.idle_timer)
+        if cl.interest:
+            self._selector.unregister(cl.socket)
+        return (cl.socket, cl.address, bytes(cl.outbox), list(cl.commands),
+                options)
+
+    def compression_stats(self, clid):
+        """Returns a tuple of the number of bytes compressed for the client
+        with id 'clid', the number of compressed bytes they became, and
+        the seconds of CPU time spent compressing them. Returns None if
+        the client is not connected.
+        """
+        cl = self._clients.get(clid)
+        if cl is None:
+            return None
+        return cl.raw_bytes, cl.compressed_bytes, cl.compress_time
 
     def shutdown(self):
         """Closes down the server, disconnecting all clients and
@@ -230,220 +619,766 @@ class MudServer(object):
         """
         # for each client
         for cl in self._clients.values():
+            if cl.compressor is not None:
+                self._end_compression(cl)
+            # make a last attempt to send anything still waiting, such as
+            # a shutdown notice
+            try:
+                cl.socket.send(cl.outbox)
+            except socket.error:
+                pass
             # close the socket, disconnecting the client
-            cl.socket.shutdown(socket.SHUT_RDWR)
+            try:
+                cl.socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                # the client may have already hung up
+                pass
             cl.socket.close()
         # stop listening for new clients
+        self._selector.close()
         self._listen_socket.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+
+    def _attempt_send(self, clid, data, notice=False):
+
+        # 'notice' marks the server's own notices (such as being marked
+        # away), which are not counted as game messages the player missed
 
-    def _attempt_send(self, clid, data):
         # python 2/3 compatability fix - convert non-unicode string to unicode
         if sys.version < '3' and type(data) != unicode: #pylint: disable=E0602
             data = unicode(data, "latin1") #pylint: disable=E0602
         try:
-            # look up the client in the client map and use 'sendall' to send
-            # the message string on the socket. 'sendall' ensures that all of
-            # the data is sent in one go
-            self._clients[clid].socket.sendall(bytearray(data, "latin1"))
+            # look up the client in the client map
+            cl = self._clients[clid]
         # KeyError will be raised if there is no client with the given id in
         # the map
         except KeyError:
             logging.error("Key error occurred.")
-            pass
-        # If there is a connection problem with the client (e.g. they have
-        # disconnected) a socket error will be raised
-        except socket.error:
-            self._handle_disconnect(clid)
-
-    def _check_for_new_connections(self):
+            return
 
-        # 'select' is used to check whether there is data waiting to be read
-        # from the socket. We pass in 3 lists of sockets, the first being those
-        # to check for readability. It returns 3 lists, the first being
-        # the sockets that are readable. The last parameter is how long to wait
-        # - we pass in 0 so that it returns immediately without waiting
-        rlist, wlist, xlist = select.select([self._listen_socket], [], [], 0)
+        # a stalled client is not reading what we send it, so we drop the
+        # message instead of letting its outbox grow without limit
+        if cl.stalled_since is not None:
+            if not notice:
+                cl.dropped += 1
+            return
 
-        # if the socket wasn't in the readable list, there's no data available,
-        # meaning no clients waiting to connect, and so we can exit the method
-        # here
-        if self._listen_socket not in rlist:
+        # queue the message in the client's outbox. The outbox is written
+        # on the next flush, as much as the socket will take without
+        # blocking. Whatever is left over is sent once the socket becomes
+        # writable again. If the client uses compression, the message is
+        # staged, and the whole batch is compressed on the next flush.
+        # The data may already be encoded (see send_message)
+        if isinstance(data, str):
+            data = data.encode("latin1")
+        self._queue_data(cl, data)
+        self._unflushed.add(clid)
+        self._queued += 1
+        self.stats["messages"] += 1
+
+        # don't let a single pass pile up more than the high watermark
+        # (flushing early will tell us if the client is stalled)
+        if len(cl.outbox) + len(cl.staged) > self._high_water:
+            self._flush_client(clid, cl)
+
+    def _flush_client(self, clid, cl):
+
+        if cl.staged:
+            self._compress_staged(cl)
+
+        # write as much of the outbox as possible, without blocking
+        if cl.outbox:
+            self.stats["writes"] += 1
+            try:
+                sent = cl.socket.send(cl.outbox)
+            except BlockingIOError:
+                sent = 0
+            # If there is a connection problem with the client (e.g. they
+            # have disconnected) a socket error will be raised
+            except socket.error:
+                self._handle_disconnect(clid)
+                return
+            del cl.outbox[:sent]
+
+        # if the outbox is still too full after writing, the client is not
+        # keeping up with us
+        if cl.stalled_since is None and len(cl.outbox) > self._high_water:
+            self._stall(clid, cl, len(cl.outbox))
+
+        # only ask the selector about writability while data is waiting,
+        # otherwise every poll would report the socket as ready
+        self._update_interest(clid, cl)
+
+        if cl.stalled_since is not None and len(cl.outbox) < self._low_water:
+            self._unstall(clid, cl)
+
+    def _queue_data(self, cl, data):
+
+        # add encoded data for the client to its outbox, or stage it if the
+        # client uses compression (see _compress_staged)
+        if cl.compressor is None:
+            cl.outbox += data
+        else:
+            cl.staged += data
+
+    def _write_gmcp(self, cl):
+
+        # queue a GMCP subnegotiation for each package updated since the
+        # last flush, returning the number of messages queued. JSON
+        # escapes every non-ASCII character, so the data can't contain a
+        # 255 byte that would need escaping
+        for package, data in cl.gmcp_pending.items():
+            message = "%s %s" % (package, json.dumps(data))
+            self._queue_data(cl, bytes((self._TN_INTERPRET_AS_COMMAND,
+                                        self._TN_SUBNEGOTIATION_START,
+                                        self._TN_GMCP))
+                             + message.encode("ascii") + self._IAC_SE)
+            # remember what the client now knows, to send only changes
+            if isinstance(data, dict):
+                sent = cl.gmcp_sent.get(package)
+                if not isinstance(sent, dict):
+                    sent = cl.gmcp_sent[package] = {}
+                sent.update(data)
+            else:
+                cl.gmcp_sent[package] = data
+        written = len(cl.gmcp_pending)
+        self.stats["gmcp_messages"] += written
+        cl.gmcp_pending.clear()
+        return written
+
+    def _start_compression(self, cl):
+
+        # tell the client that compression starts right now, and compress
+        # everything after that
+        cl.outbox += bytes((self._TN_INTERPRET_AS_COMMAND,
+                            self._TN_SUBNEGOTIATION_START,
+                            self._TN_COMPRESS2,
+                            self._TN_INTERPRET_AS_COMMAND,
+                            self._TN_SUBNEGOTIATION_END))
+        cl.compressor = zlib.compressobj(self._compression)
+        self.stats["compressed_clients"] += 1
+
+    def _compress_staged(self, cl, mode=zlib.Z_SYNC_FLUSH):
+
+        # compress the staged batch of messages into the outbox. A sync
+        # flush ends the batch on a byte boundary, so the client can
+        # decompress and show everything we have sent so far
+        start = time.thread_time()
+        data = cl.compressor.compress(cl.staged) + cl.compressor.flush(mode)
+        elapsed = time.thread_time() - start
+        cl.outbox += data
+        cl.raw_bytes += len(cl.staged)
+        cl.compressed_bytes += len(data)
+        cl.compress_time += elapsed
+        self.stats["compress_in"] += len(cl.staged)
+        self.stats["compress_out"] += len(data)
+        self.stats["compress_seconds"] += elapsed
+        cl.staged.clear()
+
+    def _end_compression(self, cl):
+
+        # finish the compressed stream. The client goes back to reading
+        # uncompressed data after the end of the stream
+        self._compress_staged(cl, zlib.Z_FINISH)
+        cl.compressor = None
+
+    def _stall(self, clid, cl, waiting):
+
+        # stop sending messages to a client that is not reading them
+        # (see _attempt_send and _check_for_stalled)
+        logging.warning("Client %s is not keeping up (%i bytes waiting)."
+                        % (clid, waiting))
+        cl.stalled_since = time.time()
+        self._stalled.add(clid)
+
+    def _unstall(self, clid, cl):
+
+        # a stalled client that has caught up receives messages again,
+        # along with a summary of what it missed
+        cl.stalled_since = None
+        self._stalled.discard(clid)
+        if cl.dropped:
+            dropped, cl.dropped = cl.dropped, 0
+            self._attempt_send(clid, "[%i messages were dropped while"
+                               " you were lagging.]\n\r" % dropped,
+                               notice=True)
+        # send the GMCP updates held back while it was stalled
+        if cl.gmcp_pending:
+            self._unflushed.add(clid)
+
+    def _update_interest(self, clid, cl):
+
+        # work out which events we need the selector to watch for:
+        # readability, unless the client has sent us too many commands, and
+        # writability, if data is waiting to be sent
+        interest = 0
+        if len(cl.commands) < self._max_backlog:
+            interest |= selectors.EVENT_READ
+        if cl.outbox:
+            interest |= selectors.EVENT_WRITE
+        if interest == cl.interest:
+            return
+        # a socket cannot be registered without any events
+        if not interest:
+            self._selector.unregister(cl.socket)
+        elif not cl.interest:
+            self._selector.register(cl.socket, interest, clid)
+        else:
+            self._selector.modify(cl.socket, interest, clid)
+        cl.interest = interest
+
+    def _check_for_new_connections(self, ready):
+
+        # 'ready' is the list of (key, events) pairs returned by the
+        # selector. If the listen socket is among them, a client is waiting
+        # to connect. Otherwise, we can exit the method here
+        if not any(key.fileobj is self._listen_socket for key, events in ready):
             return
 
-        # 'accept' returns a new socket and address info which can be used to
-        # communicate with the new client
-        joined_socket, addr = self._listen_socket.accept()
+        # accept every waiting client, up to 'max_accepts'. If any are
+        # left over, the listen socket stays ready, and the next update
+        # picks them up without waiting
+        for _ in range(self._max_accepts):
 
-        logging.info("Client connected at: " + ":".join(map(str, addr)))
+            # 'accept' returns a new socket and address info which can be
+            # used to communicate with the new client
+            try:
+                joined_socket, addr = self._listen_socket.accept()
+            except BlockingIOError:
+                # no more clients are waiting
+                return
+            except OSError as ex:
+                # we may have run out of file descriptors, so leave the
+                # remaining clients waiting until the next update
+                logging.error("Could not accept client: %s" % ex)
+                return
+
+            # set non-blocking mode on the new socket. This means that
+            # 'send' and 'recv' will return immediately without waiting
+            joined_socket.setblocking(False)
+
+            if not self._allow_connection(addr[0]):
+                self._refuse(joined_socket, addr)
+                continue
 
-        # set non-blocking mode on the new socket. This means that 'send' and
-        # 'recv' will return immediately without waiting
-        joined_socket.setblocking(False)
+            logging.info("Client connected at: " + ":".join(map(str, addr)))
+            self._record_accept(joined_socket)
+
+            # ask the operating system to detect dead connections for us
+            self._set_keepalive(joined_socket)
+
+            # construct a new _Client object to hold info about the newly
+            # connected client
+            self._add_client(self._Client(joined_socket, addr[0], b"",
+                                          time.monotonic()))
+
+    def _allow_connection(self, address):
+
+        # rate limit connections from each address with a token bucket.
+        # Each address has an allowance of connections, which refills
+        # steadily over time. A connection uses up one connection of the
+        # allowance, and is refused if there is none left
+        if self._connection_rate is None:
+            return True
+        count, period = self._connection_rate
+        now = time.monotonic()
+        allowance, last = self._allowances.get(address, (count, now))
+        allowance = min(count, allowance + (now - last) * count / period)
+        if allowance < 1:
+            self._allowances[address] = (allowance, now)
+            return False
+        self._allowances[address] = (allowance - 1, now)
+        # forget addresses once their allowance is full again
+        if self._purge_timer is None:
+            self._purge_timer = self._idle_timers.schedule(
+                period, self._purge_allowances)
+        return True
+
+    def _purge_allowances(self):
+
+        # drop every address whose allowance has refilled, as it is no
+        # different from an address we have never seen
+        count, period = self._connection_rate
+        now = time.monotonic()
+        for address, (allowance, last) in list(self._allowances.items()):
+            if allowance + (now - last) * count / period >= count:
+                del self._allowances[address]
+        if self._allowances:
+            self._purge_timer = self._idle_timers.schedule(
+                period, self._purge_allowances)
+        else:
+            self._purge_timer = None
+
+    def _refuse(self, sock, addr):
+
+        # turn away a client that is connecting too often
+        logging.warning("Refusing client at %s, which is connecting too"
+                        " often." % ":".join(map(str, addr)))
+        self.stats["refused"] += 1
+        try:
+            sock.send(b"Too many connections from your address."
+                      b" Try again later.\n\r")
+        except socket.error:
+            pass
+        sock.close()
+
+    def _record_accept(self, sock):
 
-        # construct a new _Client object to hold info about the newly connected
-        # client. Use 'nextid' as the new client's id number
-        self._clients[self._nextid] = MudServer._Client(joined_socket, addr[0],
-                                                        "", time.time())
+        # measure how long the client waited to be accepted. On Linux,
+        # the kernel reports the milliseconds since it last sent data on
+        # the connection. As we haven't sent anything yet, that is the
+        # time since the handshake. Elsewhere, we go without
+        self.stats["accepts"] += 1
+        if not hasattr(socket, "TCP_INFO"):
+            return
+        try:
+            info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+            waited = struct.unpack_from("I", info, 44)[0]
+        except (socket.error, struct.error):
+            return
+        self.stats["accept_wait_ms"] += waited
+        self.stats["accept_wait_max_ms"] = max(waited,
+                                               self.stats["accept_wait_max_ms"])
+
+    def _add_client(self, cl, announce=True):
+
+        # Use 'nextid' as the new client's id number
+        clid = self._nextid
+        self._clients[clid] = cl
+
+        # offer to compress the data we send, and to send structured data
+        # over GMCP (see _handle_negotiation). Clients adopted from
+        # elsewhere may have answered these offers already
+        if (self._compression is not None
+                and self._TN_COMPRESS2 not in cl.answered):
+            self._queue_data(cl, bytes((self._TN_INTERPRET_AS_COMMAND,
+                                        self._TN_WILL, self._TN_COMPRESS2)))
+            self._unflushed.add(clid)
+        if self._gmcp and self._TN_GMCP not in cl.answered:
+            self._queue_data(cl, bytes((self._TN_INTERPRET_AS_COMMAND,
+                                        self._TN_WILL, self._TN_GMCP)))
+            self._unflushed.add(clid)
+        self._schedule_idle_check(clid, cl)
+
+        # register the socket with the selector once, tagged with the id,
+        # so that later polls can map a ready socket straight to its client
+        self._update_interest(clid, cl)
 
         # add a new player occurence to the new events list with the player's
         # id number
-        self._new_events.append((self._EVENT_NEW_PLAYER, self._nextid))
-        self.server_queue.append(Event(EventType.PLAYER_JOIN, self._nextid, ""))
-
-
+        if announce:
+            self._new_events.append((self._EVENT_NEW_PLAYER, clid))
+            self.server_queue.append(Event(EventType.PLAYER_JOIN, clid, ""))
 
         # add 1 to 'nextid' so that the next client to connect will get a
         # unique id number
         # this id system may need to be overhauled later
         self._nextid += 1
+        return clid
 
-    def _check_for_disconnected(self):
+    def _check_for_wakeup(self, ready):
 
-        # go through all the clients
-        for id, cl in list(self._clients.items()):
+        # if another thread called 'wakeup', drain the pending bytes so
+        # that the next poll can block again
+        if not any(key.fileobj is self._wakeup_recv for key, events in ready):
+            return
+        try:
+            while self._wakeup_recv.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
 
-            # if we last checked the client less than 5 seconds ago, skip this
-            # client and move on to the next one
-            if time.time() - cl.lastcheck < 5.0:
-                continue
+    def _check_for_readers(self, ready):
 
-            # send the client an invisible character. It doesn't actually
-            # matter what we send, we're really just checking that data can
-            # still be written to the socket. If it can't, an error will be
-            # raised and we'll know that the client has disconnected.
-            self._attempt_send(id, "\x00")
+        # call back for any files added with 'add_reader'
+        if not self._readers:
+            return
+        for key, events in ready:
+            if key.fileobj in self._readers:
+                self._readers[key.fileobj]()
+
+    def _check_for_writable(self, ready):
+
+        # send waiting data to every client whose socket can take more
+        for key, events in ready:
+            if events & selectors.EVENT_WRITE and key.data in self._clients:
+                self._flush_client(key.data, self._clients[key.data])
+
+    def _check_for_stalled(self):
+
+        # disconnect any client that has stayed above the high watermark
+        # for too long. Only stalled clients need to be examined
+        now = time.time()
+        for clid in list(self._stalled):
+            cl = self._clients[clid]
+            if now - cl.stalled_since > self._stall_timeout:
+                logging.info("Disconnecting client %s, which stopped reading."
+                             % clid)
+                self._handle_disconnect(clid)
+
+    def _set_keepalive(self, sock):
+
+        # instead of writing to every client every few seconds to see if it
+        # is still there, we enable TCP keepalive. The operating system
+        # probes connections that have been silent for a while, and reports
+        # an error on the socket if the other end has gone away
+        if self._keepalive is None:
+            return
+        idle, interval, count = self._keepalive
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            # these options are not available on every platform
+            if hasattr(socket, "TCP_KEEPIDLE"):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+            elif hasattr(socket, "TCP_KEEPALIVE"):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle)
+            if hasattr(socket, "TCP_KEEPINTVL"):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL,
+                                interval)
+            if hasattr(socket, "TCP_KEEPCNT"):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count)
+        except socket.error:
+            logging.warning("Could not enable TCP keepalive.")
+
+    def _schedule_idle_check(self, clid, cl):
+
+        # work out the next time the client could become away or idle, if
+        # it sends nothing else, and check on it then
+        if cl.afk or self._afk_timeout is None:
+            timeout = self._idle_timeout
+        elif self._idle_timeout is None:
+            timeout = self._afk_timeout
+        else:
+            timeout = min(self._afk_timeout, self._idle_timeout)
+        if timeout is None:
+            return
+        delay = cl.last_active + timeout - time.monotonic()
+        cl.idle_timer = self._idle_timers.schedule(delay, self._check_idle,
+                                                   clid)
+
+    def _check_idle(self, clid):
+
+        # called by the idle timers when a client may have been idle for
+        # too long. Sending data doesn't move the timer (which would cost
+        # something on every message), so the client may well have been
+        # active since the timer was set
+        cl = self._clients.get(clid)
+        if cl is None:
+            return
+        idle = time.monotonic() - cl.last_active
+
+        if self._idle_timeout is not None and idle >= self._idle_timeout:
+            logging.info("Disconnecting client %s after %i idle seconds."
+                         % (clid, idle))
+            self._attempt_send(clid, "You have been disconnected for"
+                               " inactivity.\n\r", notice=True)
+            self._flush_client(clid, cl)
+            self._handle_disconnect(clid)
+            return
 
-            # update the last check time
-            cl.lastcheck = time.time()
+        if (self._afk_timeout is not None and not cl.afk
+                and idle >= self._afk_timeout):
+            cl.afk = True
+            self.server_queue.append(Event(EventType.PLAYER_AFK, clid, ""))
+            self._attempt_send(clid, "You are now marked as away.\n\r",
+                               notice=True)
 
-    def _check_for_messages(self):
+        self._schedule_idle_check(clid, cl)
 
-        # go through all the clients
-        for id, cl in list(self._clients.items()):
+    def _check_for_messages(self, ready):
 
-            # we use 'select' to test whether there is data waiting to be read
-            # from the client socket. The function takes 3 lists of sockets,
-            # the first being those to test for readability. It returns 3 list
-            # of sockets, the first being those that are actually readable.
-            rlist, wlist, xlist = select.select([cl.socket], [], [], 0)
+        # go through only the client sockets that the selector reported as
+        # readable. Each key's data is the id of the client that owns it
+        for key, events in ready:
+            id = key.data
 
-            # if the client socket wasn't in the readable list, there is no
-            # new data from the client - we can skip it and move on to the next
-            # one
-            if cl.socket not in rlist:
+            # skip the listen and wakeup sockets, sockets that are only
+            # writable, and any client that was disconnected earlier in
+            # this update
+            if not events & selectors.EVENT_READ or id not in self._clients:
                 continue
+            cl = self._clients[id]
 
             try:
                 # read data from the socket, using a max length of 4096
-                data = cl.socket.recv(4096).decode("latin1")
-
-                # process the data, stripping out any special Telnet commands
-                message = self._process_sent_data(cl, data)
+                data = cl.socket.recv(4096)
 
-                # if there was a message in the data
-                if message:
-
-                    # remove any spaces, tabs etc from the start and end of
-                    # the message
-                    # message will be handled by the server
-                    raw_message = message.strip()
-
-                    # add a command occurence to the new events list with the
-                    # player's id number, the command and its parameters
-                    # using our queue
-                    self.server_queue.append(Event(EventType.MESSAGE_RECEIVED, id, raw_message))
+                # a readable socket with no data means the client has
+                # closed the connection
+                if not data:
+                    self._handle_disconnect(id)
+                    continue
 
             # if there is a problem reading from the socket (e.g. the client
             # has disconnected) a socket error will be raised
             except socket.error:
                 self._handle_disconnect(id)
+                continue
+
+            self._handle_data(id, cl, data)
+
+    def _handle_data(self, id, cl, data):
+
+        # the client is clearly still here
+        cl.last_active = time.monotonic()
+        if cl.afk:
+            cl.afk = False
+            self.server_queue.append(Event(EventType.PLAYER_RETURN, id, ""))
+            # the next idle check may be a long way off
+            self._idle_timers.cancel(cl.idle_timer)
+            self._schedule_idle_check(id, cl)
+
+        # process the data, stripping out any special Telnet commands
+        # this returns every complete line found in the data
+        for message in self._process_sent_data(cl, data):
+
+            # skip any empty lines
+            if not message:
+                continue
+
+            # remove any spaces, tabs etc from the start and end of
+            # the message, and hold it until it can be released
+            # (see _release_commands)
+            cl.commands.append(message.strip())
+            self._backlogged.add(id)
+
+        # send any replies to Telnet commands on the next flush
+        if cl.outbox:
+            self._unflushed.add(id)
+
+    def _release_commands(self):
+
+        # turn waiting commands into events. A client that pastes a lot
+        # of text, or whose client sends several commands at once, only
+        # gets 'max_commands' events per update. The rest wait for later
+        # updates, so bulk input is handled at a steady rate without
+        # being lost
+        for id in list(self._backlogged):
+            cl = self._clients[id]
+            for _ in range(min(self._max_commands, len(cl.commands))):
+                message = cl.commands.popleft()
+                # add a command occurence to the new events list with the
+                # player's id number, the command and its parameters
+                # using our queue
+                self.server_queue.append(Event(EventType.MESSAGE_RECEIVED, id, message))
+            if not cl.commands:
+                self._backlogged.discard(id)
+            # resume reading from the client, if we had stopped
+            self._update_interest(id, cl)
 
     def _handle_disconnect(self, clid):
 
-        # remove the client from the clients map
-        del(self._clients[clid])
+        # the client may have already been removed (for instance, if a
+        # send failed earlier in this update)
+        if clid not in self._clients:
+            return
+
+        # remove the client from the clients map, and stop polling its socket
+        cl = self._clients.pop(clid)
+        self._stalled.discard(clid)
+        self._backlogged.discard(clid)
+        if cl.idle_timer is not None:
+            self._idle_timers.cancel(cl.idle_timer)
+        self._close_client(cl)
 
         # add a 'player left' occurence to the new events list, with the
         # player's id number
         self._new_events.append((self._EVENT_PLAYER_LEFT, clid))
         self.server_queue.append(Event(EventType.PLAYER_DISCONNECT, clid, ""))
 
+    def _close_client(self, cl):
+
+        # stop polling the client's socket and hang up
+        if cl.interest:
+            self._selector.unregister(cl.socket)
+        cl.socket.close()
+
     def _process_sent_data(self, client, data):
 
         # the Telnet protocol allows special command codes to be inserted into
         # messages. For our very simple server we don't need to response to
-        # any of these codes, but we must at least detect and skip over them
+        # most of these codes, but we must at least detect and skip over them
         # so that we don't interpret them as text data.
         # More info on the Telnet protocol can be found here:
         # http://pcmicro.com/netfoss/telnet.html
 
-        # start with no message and in the normal state
-        message = None
-        state = self._READ_STATE_NORMAL
-
-        # go through the data a character at a time
-        for c in data:
-
-            # handle the character differently depending on the state we're in:
-
-            # normal state
-            if state == self._READ_STATE_NORMAL:
-
-                # if we received the special 'interpret as command' code,
-                # switch to 'command' state so that we handle the next
-                # character as a command code and not as regular text data
-                if ord(c) == self._TN_INTERPRET_AS_COMMAND:
-                    state = self._READ_STATE_COMMAND
-
-                # if we get a newline character, this is the end of the
-                # message. Set 'message' to the contents of the buffer and
-                # clear the buffer
-                elif c == "\n":
-                    message = client.buffer
-                    client.buffer = ""
-
-                # some telnet clients send the characters as soon as the user
-                # types them. So if we get a backspace character, this is where
-                # the user has deleted a character and we should delete the
-                # last character from the buffer.
-                elif c == "\x08":
-                    client.buffer = client.buffer[:-1]
-
-                # otherwise it's just a regular character - add it to the
-                # buffer where we're building up the received message
-                else:
-                    client.buffer += c
-
-            # command state
-            elif state == self._READ_STATE_COMMAND:
-
-                # the special 'start of subnegotiation' command code indicates
-                # that the following characters are a list of options until
-                # we're told otherwise. We switch into 'subnegotiation' state
-                # to handle this
-                if ord(c) == self._TN_SUBNEGOTIATION_START:
-                    state = self._READ_STATE_SUBNEG
-
-                # if the command code is one of the 'will', 'wont', 'do' or
-                # 'dont' commands, the following character will be an option
-                # code so we must remain in the 'command' state
-                elif ord(c) in (self._TN_WILL, self._TN_WONT, self._TN_DO,
-                                self._TN_DONT):
-                    state = self._READ_STATE_COMMAND
-
-                # for all other command codes, there is no accompanying data so
-                # we can return to 'normal' state.
-                else:
-                    state = self._READ_STATE_NORMAL
-
-            # subnegotiation state
-            elif state == self._READ_STATE_SUBNEG:
-
-                # if we reach an 'end of subnegotiation' command, this ends the
-                # list of options and we can return to 'normal' state.
-                # Otherwise we must remain in this state
-                if ord(c) == self._TN_SUBNEGOTIATION_END:
-                    state = self._READ_STATE_NORMAL
-
-        # return the contents of 'message' which is either a string or None
-        return message
+        # rather than walking the data a byte at a time, we use 'find' to
+        # jump straight to the next 'interpret as command' code. Everything
+        # before it is regular text. The data stays as bytes until we have
+        # a complete line, which is then decoded
+
+        # most packets are just typed text, so if there is nothing else to
+        # handle we can split the lines off directly. (Looking for a single
+        # byte as an int is much quicker than looking for a bytes object)
+        if (not client.pending and not client.discarding
+                and self._TN_INTERPRET_AS_COMMAND not in data
+                and 0x08 not in data):
+            lines = data.decode("latin1").split("\n")
+            if client.buffer:
+                lines[0] = client.buffer.decode("latin1") + lines[0]
+            # the text after the last newline is an unfinished line
+            client.buffer = bytearray(lines.pop(), "latin1")
+            return lines
+
+        # if a Telnet command was cut off at the end of the last packet,
+        # put it back in front of the new data
+        if client.pending:
+            data = client.pending + data
+            client.pending = b""
+
+        lines = []
+        pos = 0
+        end = len(data)
+
+        # skip the rest of a subnegotiation that was too long to buffer
+        if client.discarding:
+            se = self._find_subnegotiation_end(data, 0)
+            if se == -1:
+                self._discard_subnegotiation(client, data)
+                return lines
+            client.discarding = False
+            pos = se + 2
+
+        while pos < end:
+            iac = data.find(self._IAC, pos)
+
+            # handle the text before the next command (or the end of data)
+            self._process_text(client, data, pos, end if iac == -1 else iac,
+                               lines)
+            if iac == -1:
+                break
+
+            # the command was split across packets, so keep it for later
+            if iac + 1 == end:
+                client.pending = data[iac:]
+                break
+            command = data[iac + 1]
+
+            # two 'interpret as command' codes in a row are an escaped
+            # 255 byte, which is regular text data
+            if command == self._TN_INTERPRET_AS_COMMAND:
+                client.buffer.append(command)
+                pos = iac + 2
+
+            # if the command code is one of the 'will', 'wont', 'do' or
+            # 'dont' commands, the following byte is an option code
+            elif command in (self._TN_WILL, self._TN_WONT, self._TN_DO,
+                             self._TN_DONT):
+                if iac + 2 == end:
+                    client.pending = data[iac:]
+                    break
+                self._handle_negotiation(client, command, data[iac + 2])
+                pos = iac + 3
+
+            # the special 'start of subnegotiation' command code indicates
+            # that the following bytes are a list of options, until an
+            # 'end of subnegotiation' command
+            elif command == self._TN_SUBNEGOTIATION_START:
+                se = self._find_subnegotiation_end(data, iac + 2)
+                if se == -1:
+                    # don't let a client make us buffer forever. We
+                    # skip everything until the subnegotiation ends
+                    # instead, so none of it is taken for text
+                    if end - iac <= self._MAX_SUBNEGOTIATION:
+                        client.pending = data[iac:]
+                    else:
+                        client.discarding = True
+                        self._discard_subnegotiation(client, data)
+                    break
+                self._handle_subnegotiation(client, data[iac + 2:se])
+                pos = se + 2
+
+            # for all other command codes, there is no accompanying data
+            else:
+                pos = iac + 2
+
+        # return every complete line that was received
+        return lines
+
+    def _process_text(self, client, data, start, end, lines):
+
+        # add the text in data[start:end] to the client's buffer. Each
+        # newline character is the end of a message, so we decode the
+        # buffer, add it to 'lines' and clear the buffer
+        if start == end:
+            return
+        parts = data[start:end].split(b"\n")
+        for part in parts[:-1]:
+            self._append_text(client, part)
+            lines.append(client.buffer.decode("latin1"))
+            client.buffer = bytearray()
+        self._append_text(client, parts[-1])
+
+    def _append_text(self, client, text):
+
+        # some telnet clients send the characters as soon as the user
+        # types them. So if we get a backspace character, this is where
+        # the user has deleted a character and we should delete the
+        # last character from the buffer.
+        if b"\x08" in text:
+            text = text.split(b"\x08")
+            client.buffer += text[0]
+            for part in text[1:]:
+                del client.buffer[-1:]
+                client.buffer += part
+        else:
+            client.buffer += text
+
+    def _discard_subnegotiation(self, client, data):
+
+        # 'data' is part of a subnegotiation that we are skipping. If it
+        # ends with an unescaped 'interpret as command' code, the next
+        # packet may start with the 'end of subnegotiation' code, so we
+        # keep the 255 byte for later
+        trailing = len(data) - len(data.rstrip(self._IAC))
+        client.pending = self._IAC if trailing % 2 else b""
+
+    def _find_subnegotiation_end(self, data, start):
+
+        # find the 'interpret as command', 'end of subnegotiation' pair
+        # that ends a subnegotiation. An escaped 255 byte (two 'interpret as
+        # command' codes) followed by a 240 byte is not the end, so we
+        # check how many 255 bytes come before each match
+        se = data.find(self._IAC_SE, start)
+        while se != -1:
+            escapes = 0
+            while se - escapes - 1 >= start and data[se - escapes - 1] == 255:
+                escapes += 1
+            if escapes % 2 == 0:
+                return se
+            se = data.find(self._IAC_SE, se + 1)
+        return -1
+
+    def _handle_negotiation(self, client, command, option):
+
+        # called for each 'will', 'wont', 'do' or 'dont' command received
+        # from a client. We support MCCP2 compression and GMCP, which we
+        # offer to every client when it connects
+        if (option in (self._TN_COMPRESS2, self._TN_GMCP)
+                and command in (self._TN_DO, self._TN_DONT)):
+            client.answered.add(option)
+
+        if option == self._TN_COMPRESS2 and self._compression is not None:
+            # the client agreed to compression
+            if command == self._TN_DO and client.compressor is None:
+                self._start_compression(client)
+            # the client refused (or changed its mind), so we carry on
+            # sending uncompressed data
+            elif command == self._TN_DONT and client.compressor is not None:
+                self._end_compression(client)
+
+        elif option == self._TN_GMCP and self._gmcp:
+            if command == self._TN_DO and not client.gmcp:
+                client.gmcp = True
+                self.stats["gmcp_clients"] += 1
+            elif command == self._TN_DONT:
+                client.gmcp = False
+                client.gmcp_pending.clear()
+                client.gmcp_sent.clear()
+
+    def _handle_subnegotiation(self, client, payload):
+
+        # called with the bytes between the start and end of each
+        # subnegotiation received from a client. These are ignored for now
+        pass
@@ -15,10 +15,8 @@ class Brute(Humanoid):
         '''
         if len(args) < 1:
             return
-        for char in self.location.characters:
-            if args[1] == str(char):
-                break
-        else:
+        char = self.location.find_char(args[1])
+        if char is None:
             self.message("Could not find player with name %s." % args[0])
             return
         # if we get to this point, then we slapped someone
@@ -30,10 +30,8 @@ class Healer(Humanoid):
         '''
         if len(args) < 1:
             return
-        for char in self.location.characters:
-            if args[0] == str(char):
-                break
-        else:
+        char = self.location.find_char(args[0])
+        if char is None:
             self.message("Could not find player with name %s." % args[0])
             return
         # if we get to this point, then we healed someone
@@ -1,17 +1,19 @@
 '''Defining some basic RPG classes for testing'''
 from character import Character
-from time import time
 from mudscript import server
+import mudscript
 import effect
 
 def timed(delay):
+    '''decorator for Character methods that can only be called
+    once every [delay] seconds
+    the cooldown is tracked separately for each character'''
     def delayed_cooldown(func):
-        setattr(func, "last_used", 0)
-        def cooled_down_func(*args, **kwargs):
-            diff = func.last_used + delay - time()
-            if diff < 0:
-                func.last_used = time()
-                return func(*args, **kwargs)
+        def cooled_down_func(self, *args, **kwargs):
+            if mudscript.start_cooldown(self, func.__name__, delay):
+                return func(self, *args, **kwargs)
+        cooled_down_func.__name__ = func.__name__
+        cooled_down_func.__doc__ = func.__doc__
         return cooled_down_func
     return delayed_cooldown
 
@@ -20,19 +22,31 @@ class Humanoid(Character):
     #starting_location = server.lib.locations["Hoggetown Pub and Inn"]
     max_health = 100
     
+    # seconds between each health regeneration
+    regen_period = 5
+
     def __init__(self, name=None):
         super().__init__(name)
         self._health = self.max_health
+        # timer for the next health regeneration
+        self._regen_timer = None
 
-    def update(self):
-        if self.health < self.max_health:
-            self._regen_health()
-        super().update()
-    
-    @timed(5)
     def _regen_health(self):
+        self._regen_timer = None
         self.health += 5
-    
+
+    def _start_regen(self):
+        '''schedule the next health regeneration'''
+        if self._regen_timer is None:
+            self._regen_timer = mudscript.schedule(self.regen_period,
+                                                   self._regen_health)
+
+    def _stop_regen(self):
+        '''stop regenerating health'''
+        if self._regen_timer is not None:
+            mudscript.cancel(self._regen_timer)
+            self._regen_timer = None
+
     @property
     def health(self):
         return self._health
@@ -44,6 +58,31 @@ class Humanoid(Character):
             self.die()
         if value > self.max_health:
             self._health = self.max_health
+        self.send_vitals()
+        # only regenerate while alive and injured
+        if self.is_alive and self._health < self.max_health:
+            self._start_regen()
+        else:
+            self._stop_regen()
+
+    def send_vitals(self):
+        '''send this character's health as the GMCP "Char.Vitals" package
+        only changed values reach the client, so this is cheap to call'''
+        self.send_oob("Char.Vitals", {"hp": self._health,
+                                      "maxhp": self.max_health})
+
+    def attach(self, controller):
+        super().attach(controller)
+        # let the new controller know where we stand
+        self.send_vitals()
+
+    def cancel_timers(self):
+        super().cancel_timers()
+        self._stop_regen()
+
+    def die(self, msg="%s died."):
+        self._stop_regen()
+        super().die(msg)
     
     def cmd_slap(self, args):
         '''Slap another player.
@@ -51,10 +90,8 @@ class Humanoid(Character):
         '''
         if len(args) < 2:
             return
-        for char in self.location.characters:
-            if args[1] == str(char):
-                break
-        else:
+        char = self.location.find_char(args[1])
+        if char is None:
             self.message("Could not find player with name %s." % args[1])
             return
         # if we get to this point, then we slapped someone
@@ -6,10 +6,6 @@ class MaterialItem(MiscItemBase):
     should have a material corresponding to their in-game significance '''
     _material = material.default_material
 
-    def __init__(self):
-        super().__init__()
-        self._item_name = str(type(self))
-
     @classmethod
     def material(cls):
         return cls._material
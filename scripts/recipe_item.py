@@ -1,17 +1,15 @@
-from item import UsableBase
+from item import UsableBase, Usable
 import scripts.recipes as recipes
 import random
 import util.english as eng
 import character
 
-class RecipeItem(UsableBase):
-
-    _recipe = recipes.iron_sword_recipe
-
-    def __init__(self):
-        super().__init__()
+class Recipe(Usable):
+    '''Metaclass for recipe items, naming and describing each class
+    after its recipe once, rather than every instance doing so'''
+    def __init__(self, cls, bases, namespace):
+        super().__init__(cls, bases, namespace)
         self._item_name = str(self._recipe) + " Recipe"
-        self._item_name.title()
         msg = ["A"]
         msg.append(random.choice(["tattered","yellowing"]))
         msg.append(random.choice(["vellum","papyrus","paper"]))
@@ -20,6 +18,13 @@ class RecipeItem(UsableBase):
         msg.append(str(self._recipe))
         self._description = (" ").join(msg)
 
+
+class RecipeItem(UsableBase, metaclass=Recipe):
+
+    _recipe = recipes.iron_sword_recipe
+    # recipe items keep no state of their own
+    stackable = True
+
     @classmethod
     def recipe(cls):
         return cls._recipe
@@ -0,0 +1,185 @@
+'''Module for running the world across several processes
+
+The locations of a Library are partitioned into zone shards, each owned
+by its own server process. Every process loads the whole world, but only
+the locations it owns are ever occupied; the rest are marked with the
+number of the shard that owns them (see Location.shard). When a
+character enters one of those locations, its player's connection and
+the character itself are handed to the owning process (see
+MainServer.migrate in MuddySwamp.py).
+
+Processes talk over Unix socket pairs. Client sockets are passed along
+with socket.send_fds, so a player stays connected while they move.
+This module requires a Unix-like operating system.
+'''
+import json
+import socket
+import logging
+from collections import deque
+import mudscript
+from item import make_item
+
+# largest message (including any waiting output) sent between shards
+MAX_MESSAGE = 1 << 20
+
+
+def partition(locations, count):
+    '''split [locations] into [count] zones of roughly equal size
+    [locations] = dict mapping names to Locations
+    returns a dict mapping each location name to a shard number
+
+    Locations are ordered by a breadth-first walk of their exits, and the
+    order is cut into equal pieces. Neighbouring locations tend to end up
+    in the same zone, so players cross between shards as rarely as we can
+    manage without a proper graph partitioner. The result depends only on
+    the locations, so every process computes the same partition.
+    '''
+    names = {loc: name for name, loc in locations.items()}
+    # exits may be one-way, but either direction ties locations together
+    neighbours = {name: set() for name in locations}
+    for name, loc in locations.items():
+        for exit in loc.exits:
+            other = names.get(exit.destination)
+            if other is not None and other != name:
+                neighbours[name].add(other)
+                neighbours[other].add(name)
+    order = []
+    seen = set()
+    for start in sorted(locations):
+        if start in seen:
+            continue
+        seen.add(start)
+        queue = deque([start])
+        while queue:
+            name = queue.popleft()
+            order.append(name)
+            for other in sorted(neighbours[name]):
+                if other not in seen:
+                    seen.add(other)
+                    queue.append(other)
+    size = max(1, -(-len(order) // count))
+    return {name: index // size for index, name in enumerate(order)}
+
+
+def make_channels(count):
+    '''create a channel between every pair of [count] shards
+    returns a list containing a dict for each shard, which maps the
+    number of every other shard to the socket connected to it
+    '''
+    channels = [{} for _ in range(count)]
+    for first in range(count):
+        for second in range(first + 1, count):
+            one, two = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            channels[first][second] = one
+            channels[second][first] = two
+    return channels
+
+
+class ShardLink:
+    '''The connections from one shard process to all of the others'''
+
+    def __init__(self, index, count, channels):
+        '''[index] = the number of this shard
+        [count] = the total number of shards
+        [channels] = dict mapping shard numbers to sockets, as made by
+                     make_channels
+        '''
+        self.index = index
+        self.count = count
+        self.channels = channels
+
+    def claim(self, locations):
+        '''partition [locations], marking those owned by other shards
+        returns the names of the locations this shard owns'''
+        owners = partition(locations, self.count)
+        owned = []
+        for name, loc in locations.items():
+            if owners[name] == self.index:
+                loc.shard = None
+                owned.append(name)
+            else:
+                loc.shard = owners[name]
+        return owned
+
+    def send(self, shard, state, sock):
+        '''send [state] (any JSON-friendly object) and the socket [sock]
+        to the shard numbered [shard]'''
+        data = json.dumps(state).encode()
+        if len(data) > MAX_MESSAGE:
+            raise ValueError("Message for shard %i is too large (%i bytes)"
+                             % (shard, len(data)))
+        socket.send_fds(self.channels[shard], [data], [sock.fileno()])
+
+    def receive(self, channel):
+        '''receive a message from the socket [channel]
+        returns the state and the socket that were sent
+        (the socket is None if it did not arrive)
+        '''
+        data, fds, _, _ = socket.recv_fds(channel, MAX_MESSAGE, 1)
+        if not data:
+            raise ConnectionError("Shard channel closed")
+        sock = socket.socket(fileno=fds[0]) if fds else None
+        return json.loads(data.decode()), sock
+
+    def __repr__(self):
+        return "ShardLink(%r, %r)" % (self.index, self.count)
+
+
+def character_state(char):
+    '''return a JSON-friendly summary of [char], from which
+    restore_character can build a copy in another process
+    Only attributes holding plain values (numbers, strings and so on),
+    items, equipment and the time left on cooldowns are kept. Anything
+    else, such as other running timers or effects, is lost in the move.
+    '''
+    attributes = {}
+    for name, value in vars(char).items():
+        if type(value) in (int, float, str, bool):
+            attributes[name] = value
+    return {
+        "class": str(type(char)),
+        "name": str(char),
+        "location": char.location.name,
+        "attributes": attributes,
+        "items": [[str(type(item)), quantity]
+                  for item, quantity in char.inv.stacks()],
+        "equipped": [str(type(item)) for item in char.equip_dict.values()
+                     if item is not None],
+        "aliases": char.cmd_dict.aliases(),
+        "cooldowns": {name: timer.remaining
+                      for name, timer in char.cooldowns.items()
+                      if timer is not None and timer.active},
+    }
+
+
+def restore_character(state, lib):
+    '''build a character from [state] (see character_state)
+    [lib] = the Library with the character's class and items
+    the character is not placed in any location'''
+    char = lib.char_classes[state["class"]](state["name"])
+    for name, value in state["attributes"].items():
+        # a private attribute behind a property (such as a Humanoid's
+        # _health) is set through the property, so its setter runs
+        prop = getattr(type(char), name.lstrip("_"), None)
+        if (name.startswith("_") and isinstance(prop, property)
+                and prop.fset is not None):
+            setattr(char, name.lstrip("_"), value)
+        else:
+            setattr(char, name, value)
+    for name, remaining in state["cooldowns"].items():
+        mudscript.start_cooldown(char, name, remaining)
+    for alias, replacement in state["aliases"].items():
+        char.cmd_dict.add_alias(alias, replacement)
+    for name, quantity in state["items"]:
+        try:
+            char.inv.add_item(make_item(lib.items[name]), quantity)
+        except KeyError:
+            logging.warning("Item '%s' not found, dropping it from %s."
+                            % (name, char))
+    for name in state["equipped"]:
+        try:
+            char.equip(lib.items[name](), remove_inv=False)
+        except KeyError:
+            logging.warning("Item '%s' not found, dropping it from %s."
+                            % (name, char))
+    return char
@@ -0,0 +1,177 @@
+'''behaviour tests run against both server backends, over real sockets'''
+import os
+import sys
+import time
+import socket
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from mudserver import MudServer, EventType
+from asyncserver import AsyncMudServer
+
+
+class ServerBehaviour:
+    '''tests shared by every backend, mixed into a TestCase that sets
+    'server_cls' '''
+
+    server_cls = None
+
+    def setUp(self):
+        # the Telnet offers are turned off, so clients only receive the
+        # messages the tests send
+        self.server = self.server_cls(port=0, max_commands=5,
+                                      high_water=4096, low_water=1024,
+                                      stall_timeout=0.5, afk_timeout=None,
+                                      idle_timeout=None, connection_rate=None,
+                                      compression=None, gmcp=False)
+        self.events = []
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.server.shutdown()
+
+    def port(self):
+        if isinstance(self.server, AsyncMudServer):
+            return self.server._server.sockets[0].getsockname()[1]
+        return self.server._listen_socket.getsockname()[1]
+
+    def connect(self, rcvbuf=None):
+        '''connect a new client, returns its socket and id'''
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if rcvbuf is not None:
+            # must be set before connecting to limit the TCP window
+            client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        client.connect(("127.0.0.1", self.port()))
+        self.clients.append(client)
+        joined = self.pump_until(lambda: self.find(EventType.PLAYER_JOIN,
+                                                   skip=len(self.clients) - 1))
+        return client, joined.id
+
+    def update(self):
+        '''run one update, returns the events it produced'''
+        self.server.update(0.05)
+        new = []
+        while self.server.server_queue:
+            new.append(self.server.server_queue.popleft())
+        self.events += new
+        return new
+
+    def pump_until(self, condition, timeout=5.0):
+        '''update until condition() returns something true (and return
+        it), failing the test after [timeout] seconds'''
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self.update()
+            found = condition()
+            if found:
+                return found
+        self.fail("timed out waiting for the server")
+
+    def find(self, event_type, skip=0):
+        '''returns the event of [event_type] after the first [skip]'''
+        matching = [ev for ev in self.events if ev.type is event_type]
+        if len(matching) > skip:
+            return matching[skip]
+
+    def messages(self, clid):
+        return [ev.message for ev in self.events
+                if ev.type is EventType.MESSAGE_RECEIVED and ev.id == clid]
+
+    def receive(self, client, length):
+        '''read [length] bytes from client, updating the server while we
+        wait'''
+        client.setblocking(False)
+        data = b""
+
+        def ready():
+            nonlocal data
+            try:
+                data += client.recv(length - len(data))
+            except BlockingIOError:
+                pass
+            return len(data) >= length
+        self.pump_until(ready)
+        return data
+
+    def test_join(self):
+        client, clid = self.connect()
+        self.assertEqual(self.find(EventType.PLAYER_JOIN).id, clid)
+
+    def test_lines_become_messages(self):
+        client, clid = self.connect()
+        client.sendall(b"look\r\nsay hello\nnorth\n")
+        self.pump_until(lambda: len(self.messages(clid)) == 3)
+        self.assertEqual(self.messages(clid), ["look", "say hello", "north"])
+
+    def test_max_commands_per_update(self):
+        client, clid = self.connect()
+        client.sendall(b"".join(b"c%i\n" % i for i in range(12)))
+        released = []
+        while len(released) < 12:
+            new = [ev for ev in self.update()
+                   if ev.type is EventType.MESSAGE_RECEIVED]
+            self.assertLessEqual(len(new), 5)
+            released += [ev.message for ev in new]
+        self.assertEqual(released, ["c%i" % i for i in range(12)])
+
+    def test_send_message(self):
+        first, first_id = self.connect()
+        second, second_id = self.connect()
+        self.server.send_message(first_id, "hello")
+        self.server.send_message_to_all("everyone")
+        self.assertEqual(self.receive(first, 17), b"hello\n\reveryone\n\r")
+        self.assertEqual(self.receive(second, 10), b"everyone\n\r")
+
+    def test_disconnect(self):
+        client, clid = self.connect()
+        client.close()
+        left = self.pump_until(
+            lambda: self.find(EventType.PLAYER_DISCONNECT))
+        self.assertEqual(left.id, clid)
+
+    def test_stalled_client_is_disconnected(self):
+        # a small receive buffer, so the client fills up quickly
+        client, clid = self.connect(rcvbuf=4096)
+
+        def flood():
+            # keep sending until the operating system's buffers are full
+            for _ in range(100):
+                self.server.send_message(clid, "x" * 1000)
+            return clid in self.server._stalled
+        self.pump_until(flood)
+        stalled = time.monotonic()
+        left = self.pump_until(
+            lambda: self.find(EventType.PLAYER_DISCONNECT))
+        self.assertEqual(left.id, clid)
+        self.assertGreaterEqual(time.monotonic() - stalled, 0.4)
+
+    def test_answered_options_are_not_offered_again(self):
+        # this test needs the Telnet offers turned on
+        self.server.shutdown()
+        self.server = self.server_cls(port=0, afk_timeout=None,
+                                      idle_timeout=None, connection_rate=None)
+        client, clid = self.connect()
+        self.assertEqual(self.receive(client, 6),
+                         b"\xff\xfb\x56\xff\xfb\xc9")
+        # refuse compression, agree to GMCP
+        client.sendall(b"\xff\xfe\x56\xff\xfd\xc9")
+        self.pump_until(lambda: len(self.server._clients[clid].answered) == 2)
+        released = self.server.release_client(clid)
+        self.assertEqual(sorted(released[4]), [(0x56, False), (0xc9, True)])
+        new_id = self.server.adopt_client(*released)
+        self.assertTrue(self.server._clients[new_id].gmcp)
+        self.server.send_message(new_id, "hello")
+        self.assertEqual(self.receive(client, 7), b"hello\n\r")
+
+
+class TestMudServer(ServerBehaviour, unittest.TestCase):
+    server_cls = MudServer
+
+
+class TestAsyncMudServer(ServerBehaviour, unittest.TestCase):
+    server_cls = AsyncMudServer
+
+
+if __name__ == "__main__":
+    unittest.main()
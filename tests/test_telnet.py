@@ -0,0 +1,90 @@
+'''tests for the Telnet parsing in mudserver.MudServer'''
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from mudserver import MudServer
+
+IAC_SB = b"\xff\xfa"
+IAC_SE = b"\xff\xf0"
+
+
+class TestOversizedSubnegotiation(unittest.TestCase):
+
+    def setUp(self):
+        # the parser needs no sockets, so we skip setting any up
+        self.server = MudServer.__new__(MudServer)
+        self.client = MudServer._Client(None, "", b"", 0)
+        self.subnegotiations = []
+        self.server._handle_subnegotiation = \
+            lambda client, data: self.subnegotiations.append(data)
+
+    def parse(self, *packets):
+        lines = []
+        for packet in packets:
+            lines += self.server._process_sent_data(self.client, packet)
+        return lines
+
+    def test_payload_is_not_text(self):
+        '''the rest of an oversized subnegotiation, arriving in later
+        packets, is skipped rather than taken for commands'''
+        limit = MudServer._MAX_SUBNEGOTIATION
+        lines = self.parse(b"look\n" + IAC_SB + b"\xc9" + b"x" * limit,
+                           b"say not a command\n" * 10,
+                           b"more\n" + IAC_SE + b"north\n")
+        self.assertEqual(lines, ["look", "north"])
+        self.assertEqual(self.subnegotiations, [])
+
+    def test_end_split_across_packets(self):
+        limit = MudServer._MAX_SUBNEGOTIATION
+        lines = self.parse(IAC_SB + b"x" * limit + b"\xff",
+                           b"\xf0north\n")
+        self.assertEqual(lines, ["north"])
+
+    def test_escaped_255_does_not_end(self):
+        limit = MudServer._MAX_SUBNEGOTIATION
+        lines = self.parse(IAC_SB + b"x" * limit + b"\xff\xff",
+                           b"\xf0hidden\n" + IAC_SE + b"north\n")
+        self.assertEqual(lines, ["north"])
+
+    def test_short_subnegotiation_is_handled(self):
+        lines = self.parse(IAC_SB + b"\xc9Core.Hello {}",
+                           IAC_SE + b"look\n")
+        self.assertEqual(lines, ["look"])
+        self.assertEqual(self.subnegotiations, [b"\xc9Core.Hello {}"])
+
+
+class TestPlainText(unittest.TestCase):
+    '''packets with no Telnet commands take a shorter path through the
+    parser, which must give the same lines'''
+
+    def setUp(self):
+        self.server = MudServer.__new__(MudServer)
+        self.client = MudServer._Client(None, "", b"", 0)
+
+    def parse(self, *packets):
+        lines = []
+        for packet in packets:
+            lines += self.server._process_sent_data(self.client, packet)
+        return lines
+
+    def test_lines(self):
+        self.assertEqual(self.parse(b"look\r\nsay hi\n"), ["look\r", "say hi"])
+        self.assertEqual(self.client.buffer, b"")
+
+    def test_line_split_across_packets(self):
+        lines = self.parse(b"lo", b"ok\nno", b"rt", b"h\nsay")
+        self.assertEqual(lines, ["look", "north"])
+        self.assertEqual(self.client.buffer, b"say")
+
+    def test_after_telnet_command(self):
+        # the start of the line arrived with a command, the end without
+        lines = self.parse(b"\xff\xfb\x18lo", b"ok\n")
+        self.assertEqual(lines, ["look"])
+
+    def test_backspace(self):
+        self.assertEqual(self.parse(b"lookx\x08\n"), ["look"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+'''tests for util.tickbudget'''
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from util.tickbudget import TickBudget
+
+
+class FakeClock:
+    '''a clock that only moves when told to'''
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTickBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.budget = TickBudget(0.1, clock=self.clock)
+
+    def run_pass(self, duration):
+        with self.budget:
+            self.clock.now += duration
+
+    def test_pass_within_budget(self):
+        self.run_pass(0.05)
+        self.assertEqual(self.budget.passes, 1)
+        self.assertEqual(self.budget.overruns, 0)
+        self.assertAlmostEqual(self.budget.last_duration, 0.05)
+
+    def test_overrun_is_counted_and_logged(self):
+        with self.assertLogs(level="WARNING"):
+            self.run_pass(0.25)
+        self.assertEqual(self.budget.overruns, 1)
+
+    def test_last_and_max_duration(self):
+        with self.assertLogs(level="WARNING"):
+            self.run_pass(0.3)
+        self.run_pass(0.02)
+        self.assertEqual(self.budget.passes, 2)
+        self.assertEqual(self.budget.overruns, 1)
+        self.assertAlmostEqual(self.budget.last_duration, 0.02)
+        self.assertAlmostEqual(self.budget.max_duration, 0.3)
+
+    def test_pass_that_raises_is_still_timed(self):
+        with self.assertRaises(RuntimeError):
+            with self.budget:
+                self.clock.now += 0.01
+                raise RuntimeError
+        self.assertEqual(self.budget.passes, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
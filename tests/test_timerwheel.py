@@ -0,0 +1,93 @@
+'''tests for util.timerwheel'''
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from util.timerwheel import TimerWheel
+
+
+class FakeClock:
+    '''a clock that only moves when told to'''
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTimerWheel(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.wheel = TimerWheel(resolution=0.1, clock=self.clock)
+        self.fired = []
+
+    def fire(self, name):
+        self.fired.append((name, self.clock.now))
+
+    def run_until(self, seconds):
+        '''advance the clock (and wheel) one tick at a time
+        (timers fire on tick boundaries, so up to one tick early)'''
+        while self.clock.now < seconds:
+            self.clock.now = round(self.clock.now + 0.1, 6)
+            self.wheel.advance()
+
+    def test_schedule_after_idle_gap(self):
+        '''a timer scheduled while the wheel has been left idle still
+        waits its full delay'''
+        self.wheel.advance()
+        self.clock.now = 3.0
+        self.wheel.schedule(5, self.fire, "late")
+        self.run_until(7.8)
+        self.assertEqual(self.fired, [])
+        self.run_until(8.1)
+        self.assertEqual([name for name, _ in self.fired], ["late"])
+
+    def test_reschedule_after_idle_gap(self):
+        timer = self.wheel.schedule(1, self.fire, "timer")
+        self.clock.now = 0.5
+        self.wheel.advance()
+        self.clock.now = 3.0
+        timer.reschedule(2)
+        self.run_until(4.8)
+        self.assertEqual(self.fired, [])
+        self.run_until(5.1)
+        self.assertEqual([name for name, _ in self.fired], ["timer"])
+
+    def test_repeat(self):
+        timer = self.wheel.repeat(1, self.fire, "tick")
+        self.run_until(3.5)
+        self.assertEqual(len(self.fired), 3)
+        timer.cancel()
+        self.run_until(5)
+        self.assertEqual(len(self.fired), 3)
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_repeat_skips_missed_runs(self):
+        self.wheel.repeat(1, self.fire, "tick")
+        self.clock.now = 10.05
+        self.wheel.advance()
+        self.assertEqual(len(self.fired), 1)
+        self.run_until(11.1)
+        self.assertEqual(len(self.fired), 2)
+
+    def test_repeat_cancelled_by_callback(self):
+        def once():
+            self.fired.append(timer)
+            timer.cancel()
+        timer = self.wheel.repeat(0.5, once)
+        self.run_until(3)
+        self.assertEqual(len(self.fired), 1)
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_cancel(self):
+        timer = self.wheel.schedule(1, self.fire, "cancelled")
+        timer.cancel()
+        self.run_until(2)
+        self.assertEqual(self.fired, [])
+        self.assertEqual(len(self.wheel), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,18 @@
+'''Module for messages that are sent to many players at once'''
+
+
+class Broadcast(str):
+    '''A message sent to many players, such as everyone in a location
+    A Broadcast behaves exactly like the string it holds, but remembers
+    the bytes it is sent as. The message is encoded for the first player
+    it is sent to, and every other player shares the same bytes
+    (see MudServer.send_message).
+    '''
+
+    def encode_line(self):
+        '''return the message, ending in a newline, as latin-1 bytes'''
+        try:
+            return self._line
+        except AttributeError:
+            self._line = (self + "\n\r").encode("latin1")
+            return self._line
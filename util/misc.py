@@ -10,7 +10,8 @@ def camel_to_space(name):
         output += letter
     return output.strip()
 
-def group_and_count(items, format="%s\t[%i]", single_format="%s", sep="\n"):
+def group_and_count(items, format="%s\t[%i]", single_format="%s", sep="\n",
+                    counted=False):
     '''takes a list of items and a formatter,
     and produces a list with counts
     if items = ["apple", "apple", "banana", "cap", "cap", "cap"]
@@ -18,11 +19,17 @@ def group_and_count(items, format="%s\t[%i]", single_format="%s", sep="\n"):
         apple    [2]
         banana
         cap      [3]
+    if counted is True, items is a list of (item, count) pairs instead,
+    such as [("apple", 2), ("banana", 1), ("cap", 3)]
     '''
     counts = {}
-    for item in items:
-        if item not in counts:
-            counts[item] = items.count(item)
+    if counted:
+        for item, count in items:
+            counts[item] = counts.get(item, 0) + count
+    else:
+        for item in items:
+            if item not in counts:
+                counts[item] = items.count(item)
     unique_items = list(counts.keys())
     unique_items.sort()
     output = []
@@ -0,0 +1,50 @@
+'''module containing the TickBudget class
+a TickBudget measures each pass of the game loop against the length of
+a game tick, so that passes running over budget are noticed
+'''
+import time
+import logging
+
+
+class TickBudget:
+    '''times passes of the game loop against a budget (in seconds)
+    Use the budget as a context manager around each pass:
+        with budget:
+            ...
+    A pass that takes longer than the budget is an overrun, which is
+    logged and counted.
+    '''
+
+    def __init__(self, budget, clock=time.perf_counter):
+        '''create a TickBudget allowing [budget] seconds per pass
+        [clock] is the function used to tell the time (in seconds)'''
+        if budget <= 0:
+            raise ValueError("Budget must be positive, received %r" % budget)
+        self.budget = budget
+        self._clock = clock
+        self._start = None
+        self.passes = 0
+        self.overruns = 0
+        self.last_duration = 0
+        self.max_duration = 0
+
+    def __enter__(self):
+        self._start = self._clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.record(self._clock() - self._start)
+        self._start = None
+
+    def record(self, duration):
+        '''account for a pass that took [duration] seconds'''
+        self.passes += 1
+        self.last_duration = duration
+        self.max_duration = max(self.max_duration, duration)
+        if duration > self.budget:
+            self.overruns += 1
+            logging.warning("Game loop pass took %.1f ms (budget is %.1f ms)"
+                            % (duration * 1000, self.budget * 1000))
+
+    def __repr__(self):
+        return "TickBudget(%r)" % self.budget
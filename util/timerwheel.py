@@ -0,0 +1,241 @@
+'''module containing the TimerWheel class
+a TimerWheel schedules callbacks to run after a delay (or repeatedly,
+at a fixed period), with constant time insertion, cancellation, and
+expiry
+'''
+import time
+import logging
+import traceback
+
+
+class Timer:
+    '''a callback scheduled to run on a TimerWheel
+    Timers should not be created directly, use TimerWheel.schedule
+    (or TimerWheel.repeat)'''
+
+    # timers are created in great numbers, so we avoid a __dict__
+    __slots__ = ("wheel", "expires", "callback", "args", "period", "_slot")
+
+    def __init__(self, wheel, expires, callback, args, period=None):
+        self.wheel = wheel
+        # the tick on which this timer expires
+        self.expires = expires
+        self.callback = callback
+        self.args = args
+        # the number of ticks between each run of a repeating timer
+        # (None for timers that run once)
+        self.period = period
+        # the set (wheel slot) that currently holds this timer
+        self._slot = None
+
+    @property
+    def active(self):
+        '''returns True if the timer has not expired or been cancelled'''
+        return self._slot is not None
+
+    @property
+    def remaining(self):
+        '''returns the number of seconds until this timer expires'''
+        return self.wheel.time_left(self)
+
+    def cancel(self):
+        '''cancel this timer (does nothing if the timer is not active)'''
+        self.wheel.cancel(self)
+
+    def reschedule(self, delay):
+        '''run this timer [delay] seconds from now instead'''
+        self.wheel.reschedule(self, delay)
+
+    def __repr__(self):
+        return "Timer(%r, %r, expires=%r)" % (self.callback, self.args,
+                                              self.expires)
+
+
+class TimerWheel:
+    '''hierarchical timer wheel
+
+    Time is divided into ticks of length [resolution]. The wheel is made
+    of [levels] rings of 2**[slot_bits] slots each. The first ring holds
+    timers expiring within the next 2**slot_bits ticks, one slot per tick.
+    Each ring after that covers a range 2**slot_bits times larger.
+    Whenever a ring wraps around, the next slot of the ring above it is
+    'cascaded' down, so timers move closer to the first ring as they
+    approach their expiry.
+
+    Inserting or cancelling a timer is O(1), and expiring a tick only
+    touches the timers that are actually due. Idle timers cost nothing.
+    '''
+
+    def __init__(self, resolution=0.1, slot_bits=6, levels=4,
+                 clock=time.monotonic):
+        '''create a wheel with ticks of [resolution] seconds
+        [clock] is the function used to tell the time (in seconds)'''
+        self.resolution = resolution
+        self._bits = slot_bits
+        self._mask = (1 << slot_bits) - 1
+        self._levels = [[set() for _ in range(1 << slot_bits)]
+                        for _ in range(levels)]
+        # timers too far in the future to fit in any ring
+        self._overflow = set()
+        self._clock = clock
+        self._start = clock()
+        # the last tick that has been processed
+        self._tick = 0
+        self._count = 0
+
+    def __len__(self):
+        '''returns the number of pending timers'''
+        return self._count
+
+    def schedule(self, delay, callback, *args):
+        '''call callback(*args) in [delay] seconds
+        returns a Timer that can be cancelled or rescheduled
+        '''
+        timer = Timer(self, self._expiry(delay), callback, args)
+        self._insert(timer)
+        self._count += 1
+        return timer
+
+    def repeat(self, period, callback, *args):
+        '''call callback(*args) every [period] seconds, starting [period]
+        seconds from now, until the returned Timer is cancelled
+        if the wheel falls behind, missed runs are skipped rather than
+        run back-to-back
+        '''
+        timer = Timer(self, self._expiry(period), callback, args,
+                      self._delay_to_ticks(period))
+        self._insert(timer)
+        self._count += 1
+        return timer
+
+    def cancel(self, timer):
+        '''cancel [timer], if it has not already expired'''
+        if timer._slot is not None:
+            timer._slot.discard(timer)
+            timer._slot = None
+            self._count -= 1
+
+    def time_left(self, timer):
+        '''returns the number of seconds until [timer] expires
+        (0 if it is due, or no longer active)'''
+        if timer._slot is None:
+            return 0
+        deadline = self._start + timer.expires * self.resolution
+        return max(0, deadline - self._clock())
+
+    def reschedule(self, timer, delay):
+        '''move [timer] to expire [delay] seconds from now
+        expired or cancelled timers are scheduled again'''
+        self.cancel(timer)
+        timer.expires = self._expiry(delay)
+        self._insert(timer)
+        self._count += 1
+
+    def _expiry(self, delay):
+        '''returns the tick [delay] seconds from now
+        the wheel is only advanced now and then, so the last processed
+        tick may be well behind the current time'''
+        now = max(self._tick, self.current_tick())
+        return now + self._delay_to_ticks(delay)
+
+    def _delay_to_ticks(self, delay):
+        '''convert a delay (in seconds) into a number of ticks
+        a timer always expires on a later tick than the current one'''
+        ticks = -int(-delay // self.resolution)
+        return max(1, ticks)
+
+    def _insert(self, timer):
+        '''place [timer] into the proper slot'''
+        remaining = timer.expires - self._tick
+        for level, ring in enumerate(self._levels):
+            if remaining < 1 << (self._bits * (level + 1)):
+                slot = ring[(timer.expires >> (self._bits * level)) & self._mask]
+                break
+        else:
+            slot = self._overflow
+        slot.add(timer)
+        timer._slot = slot
+
+    def _cascade(self):
+        '''move timers down from the upper rings, as the rings wrap'''
+        # find the highest ring that needs to be cascaded on this tick
+        level = 0
+        while (level + 1 < len(self._levels) and
+               self._tick & ((1 << (self._bits * (level + 1))) - 1) == 0):
+            level += 1
+        # re-place the overflow if every ring has wrapped
+        if (level + 1 == len(self._levels) and
+                self._tick & ((1 << (self._bits * (level + 1))) - 1) == 0):
+            self._replace(self._overflow)
+        # cascade from the top down, so timers can fall several rings
+        while level > 0:
+            index = (self._tick >> (self._bits * level)) & self._mask
+            self._replace(self._levels[level][index])
+            level -= 1
+
+    def _replace(self, slot):
+        '''empty [slot], reinserting each timer'''
+        timers = list(slot)
+        slot.clear()
+        for timer in timers:
+            self._insert(timer)
+
+    def current_tick(self):
+        '''returns the tick corresponding to the current time'''
+        return int((self._clock() - self._start) // self.resolution)
+
+    def advance(self, now_tick=None):
+        '''run every timer that has expired
+        [now_tick] defaults to the tick of the current time
+        returns the number of timers that were run'''
+        if now_tick is None:
+            now_tick = self.current_tick()
+        # nothing is pending, we can jump straight to the present
+        if self._count == 0:
+            self._tick = max(self._tick, now_tick)
+            return 0
+        fired = 0
+        while self._tick < now_tick:
+            self._tick += 1
+            if self._tick & self._mask == 0:
+                self._cascade()
+            slot = self._levels[0][self._tick & self._mask]
+            while slot:
+                timer = slot.pop()
+                timer._slot = None
+                self._count -= 1
+                fired += 1
+                # a repeating timer is placed again before it runs, so
+                # that the callback may cancel or reschedule it
+                if timer.period is not None:
+                    timer.expires = now_tick + timer.period
+                    self._insert(timer)
+                    self._count += 1
+                try:
+                    timer.callback(*timer.args)
+                except Exception:
+                    logging.error(traceback.format_exc())
+            if self._count == 0:
+                self._tick = now_tick
+        return fired
+
+    def time_until_next(self):
+        '''returns the number of seconds until the wheel must next be
+        advanced, or None if no timers are pending
+        this may be earlier than the next expiry (when a ring wraps)'''
+        if self._count == 0:
+            return None
+        # look for the first occupied slot in the first ring
+        ring = self._levels[0]
+        next_tick = self._tick + 1
+        while next_tick & self._mask:
+            if ring[next_tick & self._mask]:
+                break
+            next_tick += 1
+        # otherwise, we must wake when the first ring wraps
+        deadline = self._start + next_tick * self.resolution
+        return max(0, deadline - self._clock())
+
+    def __repr__(self):
+        return "TimerWheel(resolution=%r, pending=%r)" % (self.resolution,
+                                                          self._count)